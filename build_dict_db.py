@@ -0,0 +1,32 @@
+"""
+build_dict_db compiles the dictionary source files in the data directory into
+the sqlite database read by common.sqlite_dict.SqliteDict.
+"""
+
+from absl import app
+from absl import flags
+import logging
+import time
+
+from common import config
+from common import sqlite_dict
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('data_dir', None,
+                    'Directory with dictionary source files, defaults to the '
+                    'data directory from config.json.')
+flags.DEFINE_string('db_path', None,
+                    'Path to the output database, defaults to the dictionary '
+                    'database path from config.json.')
+
+def main(argv):
+  data_dir = FLAGS.data_dir or config.get_data_dir()
+  db_path = FLAGS.db_path or config.get_dict_db_path()
+  start = time.time()
+  sqlite_dict.build(data_dir, db_path)
+  print('Built {} in {:.1f}s'.format(db_path, time.time() - start))
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  app.run(main)
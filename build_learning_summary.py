@@ -22,12 +22,21 @@ class ReportGenerator:
   def __init__(self, output_file):
     self.outfile = open(output_file, 'w')
 
-    self.d = cdict.Dict(config.get_data_dir())
+    self.d = cdict.Dict.from_snapshot(config.get_data_dir())
 
-    self.anki_reader = anki.AnkiReader(config.get_anki_collection())
+    self.anki_reader = anki.AnkiReader(
+      config.get_anki_collection(),
+      known_cache_path=config.get_anki_known_cache_path())
     self.known_chars = set(self.anki_reader.get_known_characters())
     self.known_legacy_words = set(self.anki_reader.get_known_legacy_words())
     self.known_words = set(self.anki_reader.get_known_words())
+    # How well each known item is remembered, from the review history.
+    known_scores = self.anki_reader.get_known_scores()
+    self.char_scores = known_scores[anki.CHARACTERS_DECK]
+    self.word_scores = {}
+    for deck_scores in known_scores.values():
+      for w, score in deck_scores.items():
+        self.word_scores[w] = max(self.word_scores.get(w, 0.0), score)
 
     logging.info('{} known characters.'.format(len(self.known_chars)))
     logging.info('{} known legacy words.'.format(len(self.known_legacy_words)))
@@ -56,23 +65,33 @@ class ReportGenerator:
 
     known_chars = 0
     coverage = 0.0
+    weighted_coverage = 0.0
     for c in self.known_chars:
       if not c in self.d.entries:
         continue
       known_chars += 1
       coverage += self.d.entries[c].char_frequency
+      weighted_coverage += (self.char_scores.get(c, 0.0) *
+                            self.d.entries[c].char_frequency)
 
     word_coverage = 0.0
+    weighted_word_coverage = 0.0
     for w, entry in self.d.entries.items():
       if (w in self.known_words or w in self.known_legacy_words or
           w in self.known_chars):
         word_coverage += entry.word_frequency
+        weighted_word_coverage += (self.word_scores.get(w, 0.0) *
+                                   entry.word_frequency)
 
     self.outfile.write('<p>Total known characters = {}'.format(known_chars))
     self.outfile.write('<p>Total frequency coverage = %.2f%%' % (100 * coverage))
+    self.outfile.write('<p>Recall weighted frequency coverage = %.2f%%' % (
+      100 * weighted_coverage))
     self.outfile.write('<p>Total known words = {}'.format(
       len(self.known_words | self.known_legacy_words)))
     self.outfile.write('<p>Total word coverage = %.2f%%' % (100 * word_coverage))
+    self.outfile.write('<p>Recall weighted word coverage = %.2f%%' % (
+      100 * weighted_word_coverage))
 
     self.outfile.write('<p>HSK Word Coverage</p>')
     self.outfile.write('<table border="1">')
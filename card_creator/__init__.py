@@ -2,6 +2,7 @@ import os
 from flask import Flask
 
 from common import config
+from exampledb import exampledb
 
 def create_app(test_config=None):
   # Create and configure the app.
@@ -12,7 +13,14 @@ def create_app(test_config=None):
     PENDING_ANKI_CSV=config.get_pending_anki_csv(),
     PENDING_CHAR_CSV=config.get_pending_char_csv(),
     ANKI_COLLECTION=config.get_anki_collection(),
+    ANKI_KNOWN_CACHE=config.get_anki_known_cache_path(),
+    ANKI_NOTE_SEARCH=config.get_anki_note_search_path(),
+    SCRAPE_CACHE=config.get_scrape_cache_dir(),
     DATA_DIR=config.get_data_dir(),
+    # Seconds between checks for changed dictionary data or anki collection.
+    RELOAD_INTERVAL=5.0,
+    # Seconds after which stored example sentences are scraped again.
+    EXAMPLE_TTL=exampledb.EXAMPLE_TTL,
   )
 
   if test_config is None:
@@ -1,41 +1,140 @@
+from collections import namedtuple
 import csv
+import os
+import threading
 from flask import Blueprint, render_template, jsonify, g, request, current_app
 
+from common import cdict
+from common import pool
 from common.anki import AnkiReader
 from common.cdict import Dict
+from common.pinyin_index import PinyinIndex
+from exampledb import difficulty
+from exampledb import fetch
 from exampledb.exampledb import ExampleDb
+from . import refresh
 
 bp = Blueprint('cards', __name__)
 
 # I'm running this locally as an app, so for expediency we store
 # global variables instead of dealing with application context or sessions.
-cdict = None
+# The dictionary and known words are refresh.Reloadable, reloaded in the
+# background when the data files or the anki collection change. Each global
+# is created under its own lock, as creating the Reloadables runs the first
+# load, which takes seconds and must not hold up creating the others.
+
+# The dictionary and the indexes built from it, swapped in together.
+DictData = namedtuple('DictData', ['dict', 'pinyin_index', 'vocabulary'])
+
+def load_dict_data(data_dir):
+  d = Dict.from_snapshot(data_dir)
+  # Load the english index now, rather than on the first search.
+  d.english_index
+  return DictData(d, PinyinIndex(d.entries), difficulty.Vocabulary(d))
+
+dict_data = None
+_dict_data_lock = threading.Lock()
+def get_dict_data():
+  global dict_data
+  if dict_data is None:
+    with _dict_data_lock:
+      if dict_data is None:
+        data_dir = current_app.config['DATA_DIR']
+        dict_data = refresh.Reloadable(
+          'dictionary', lambda: load_dict_data(data_dir),
+          [os.path.join(data_dir, f) for f in cdict.SOURCE_FILES],
+          current_app.config['RELOAD_INTERVAL'])
+  return dict_data.get()
+
+
 def get_dict():
-  global cdict
-  if cdict is None:
-    cdict = Dict(current_app.config['DATA_DIR'])
-  return cdict
+  return get_dict_data().dict
+
 
+def get_pinyin_index():
+  return get_dict_data().pinyin_index
 
+
+# Process-wide pools of database connections. A request takes at most one
+# of each from the pool on first use, and puts it back when it ends.
+example_db_pool = None
+_example_db_pool_lock = threading.Lock()
 def get_example_db():
+  global example_db_pool
   if 'example_db' not in g:
-    g.example_db = ExampleDb(current_app.config['EXAMPLE_DB'])
+    if example_db_pool is None:
+      with _example_db_pool_lock:
+        if example_db_pool is None:
+          db_path = current_app.config['EXAMPLE_DB']
+          response_cache = fetch.ResponseCache(
+            current_app.config['SCRAPE_CACHE'])
+          example_ttl = current_app.config['EXAMPLE_TTL']
+          example_db_pool = pool.Pool(
+            lambda: ExampleDb(db_path, response_cache=response_cache,
+                              example_ttl=example_ttl))
+    g.example_db = example_db_pool.acquire()
+    # The dictionary may have been reloaded since the last request.
+    g.example_db.vocabulary = get_dict_data().vocabulary
   return g.example_db
 
 
+# All pooled readers share the deck map read by the first one.
+anki_decks = None
+def make_anki_reader(collection_path, note_search_path):
+  global anki_decks
+  reader = AnkiReader(collection_path, decks=anki_decks,
+                      note_search_path=note_search_path)
+  anki_decks = reader.decks
+  return reader
+
+anki_reader_pool = None
+_anki_reader_pool_lock = threading.Lock()
 def get_anki_reader():
+  global anki_reader_pool
   if 'anki_reader' not in g:
-    g.anki_reader = AnkiReader(current_app.config['ANKI_COLLECTION'])
+    if anki_reader_pool is None:
+      with _anki_reader_pool_lock:
+        if anki_reader_pool is None:
+          collection_path = current_app.config['ANKI_COLLECTION']
+          note_search_path = current_app.config['ANKI_NOTE_SEARCH']
+          anki_reader_pool = pool.Pool(
+            lambda: make_anki_reader(collection_path, note_search_path))
+    g.anki_reader = anki_reader_pool.acquire()
   return g.anki_reader
 
 
-known_words=None
+@bp.teardown_app_request
+def release_connections(exception):
+  example_db = g.pop('example_db', None)
+  if example_db is not None:
+    example_db_pool.release(example_db)
+  anki_reader = g.pop('anki_reader', None)
+  if anki_reader is not None:
+    anki_reader_pool.release(anki_reader)
+
+
+def load_known_words(collection_path, known_cache_path):
+  reader = AnkiReader(collection_path, known_cache_path=known_cache_path)
+  known_words = set(reader.get_known_legacy_words() + reader.get_known_words())
+  reader.conn.close()
+  return known_words
+
+known_words = None
+_known_words_lock = threading.Lock()
 def get_known_words():
   global known_words
   if known_words is None:
-    reader = get_anki_reader()
-    known_words = set(reader.get_known_legacy_words() + reader.get_known_words())
-  return known_words
+    with _known_words_lock:
+      if known_words is None:
+        collection_path = current_app.config['ANKI_COLLECTION']
+        known_cache_path = current_app.config['ANKI_KNOWN_CACHE']
+        # Anki writes through a write-ahead log, so watch that too.
+        known_words = refresh.Reloadable(
+          'known words',
+          lambda: load_known_words(collection_path, known_cache_path),
+          [collection_path, collection_path + '-wal'],
+          current_app.config['RELOAD_INTERVAL'])
+  return known_words.get()
 
 
 @bp.route('/')
@@ -64,12 +163,54 @@ def lookup(word):
   return jsonify(data)
 
 
+def search_results(d, words):
+  results = []
+  for word in words:
+    entry = d.entries[word]
+    result = {}
+    result["word"] = word
+    result["traditional"] = entry.traditional
+    result["definitions"] = []
+    for meaning in entry.meanings:
+      definition = {}
+      definition["pinyin_diacritic"] = meaning.pinyin_diacritic
+      definition["meaning"] = meaning.meaning
+      result["definitions"].append(definition)
+    results.append(result)
+  return results
+
+
+@bp.route("/api/search/pinyin/<q>")
+def search_pinyin(q):
+  limit = request.args.get('limit', 20, type=int)
+  data = get_dict_data()
+  words = data.pinyin_index.search(q, limit)
+  return jsonify({"results": search_results(data.dict, words)})
+
+
+@bp.route("/api/search/english/<q>")
+def search_english(q):
+  limit = request.args.get('limit', 20, type=int)
+  d = get_dict()
+  words = d.search_english(q, limit)
+  return jsonify({"results": search_results(d, words)})
+
+
+@bp.route("/api/search/cards/<q>")
+def search_cards(q):
+  limit = request.args.get('limit', 20, type=int)
+  results = []
+  for deck, note in get_anki_reader().search_notes(q, limit):
+    results.append({"deck": deck.replace(u'\x1f', '::'), "note": note})
+  return jsonify({"results": results})
+
+
 @bp.route("/api/examples/<word>")
 def examples(word):
   data = {}
 
-  # Get example sentences.
-  db_examples = get_example_db().get_examples(word)
+  # Get example sentences, the ones with the fewest unknown words first.
+  db_examples = get_example_db().get_ranked_examples(word, get_known_words())
   data["examples"] = []  
   for db_example in db_examples:
     example = {}
@@ -147,9 +288,12 @@ def char_info(char):
   reader = get_anki_reader()
   data["cards"] = reader.get_character_cards(char)
 
-  # Get words containing.
+  # Get words containing, optionally only the known or unknown ones.
   known_words = get_known_words()
-  words = get_dict().char_to_words[char]
+  limit = request.args.get('limit', 100, type=int)
+  known = request.args.get('known', None, type=int)
+  words = get_dict().word_index.search(
+    char, limit, known_words, None if known is None else bool(known))
   data["words"] = []
   for (word, freq) in words:
     data["words"].append((word, freq, word in known_words))
@@ -0,0 +1,77 @@
+"""Background reloading of data derived from files on disk.
+
+A Reloadable holds a value loaded from some source files. A daemon thread
+polls the size and modification time of the sources, and when they change,
+loads a new value and swaps it in with a single assignment. Requests keep
+using the old value until then, so they never wait on a reload.
+"""
+
+import logging
+import os
+import threading
+
+DEFAULT_INTERVAL = 5.0
+
+
+def _fingerprint(paths):
+  result = []
+  for path in paths:
+    try:
+      st = os.stat(path)
+      result.append((st.st_size, st.st_mtime_ns))
+    except FileNotFoundError:
+      result.append(None)
+  return result
+
+
+class Reloadable:
+  """A value which is reloaded in the background when its sources change."""
+
+  def __init__(self, name, load, source_paths, interval=DEFAULT_INTERVAL):
+    """Loads the value, and starts watching its sources.
+
+    Args:
+      name: Name of the value, for logging.
+      load: Function returning a new value.
+      source_paths: Files the value is loaded from. Files that do not exist
+        yet are watched for being created.
+      interval: Seconds between checks of the source files.
+    """
+    self.name = name
+    self._load = load
+    self._source_paths = source_paths
+    self._interval = interval
+    self._stop = threading.Event()
+    self._fingerprint = _fingerprint(source_paths)
+    self.value = load()
+    self._thread = threading.Thread(
+      target=self._run, name='reload-{}'.format(name), daemon=True)
+    self._thread.start()
+
+  def get(self):
+    return self.value
+
+  def stop(self):
+    self._stop.set()
+
+  def reload_if_changed(self):
+    """Reloads the value if its sources changed, returns True if it did."""
+    fingerprint = _fingerprint(self._source_paths)
+    if fingerprint == self._fingerprint:
+      return False
+    logging.info('Reloading {}'.format(self.name))
+    value = self._load()
+    # Sources changing during the load are picked up by the next check.
+    self._fingerprint = fingerprint
+    self.value = value
+    logging.info('Reloaded {}'.format(self.name))
+    return True
+
+  def _run(self):
+    while not self._stop.wait(self._interval):
+      try:
+        self.reload_if_changed()
+      except Exception:
+        # Keep serving the old value, and retry on the next change.
+        logging.exception('Failed to reload {}'.format(self.name))
+        self._fingerprint = _fingerprint(self._source_paths)
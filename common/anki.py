@@ -1,25 +1,197 @@
 # -*- coding: utf-8 -*-
 # Utility for reading anki collection.
 
+from array import array
+import bisect
+from collections import namedtuple
+import itertools
 import json
+import logging
+import marshal
 import os.path
 import re
 import shutil
 import sqlite3
+import time
+
+from common.note_search import NoteSearch
+
+CHARACTERS_DECK = u'Chinese\x1fCharacters'
+LEGACY_WORDS_DECK = u'Chinese\x1fWords'
+GENERAL_DECK = u'Chinese\x1fGeneral'
+
+# The field holding the word of a note, in each of the decks above.
+WORD_FIELDS = {
+  CHARACTERS_DECK: 0,
+  LEGACY_WORDS_DECK: 0,
+  GENERAL_DECK: 3,
+}
+
+# Format version of the known items cache, see AnkiReader.
+KNOWN_CACHE_VERSION = 1
+
+# Number of note ids per query when fetching notes by id.
+_FETCH_BATCH = 500
+
+# revlog types of learning, review and relearning entries. Later types are
+# filtered deck reviews and manual rescheduling, which say little about
+# memory.
+_REVLOG_MEMORY_TYPES = (0, 1, 2)
+_REVLOG_REVIEW = 1
+_MS_PER_DAY = 24 * 60 * 60 * 1000
+
+# Review history of a card. `reviews` counts review entries, and `lapses`
+# those answered with 'again'. `retention` is the fraction of
+# reviews passed, or None if there are none. `last_review` is the time of the
+# last entry in ms since the epoch, and `stability` the interval set then, in
+# days, which Anki picks so that recall drops to about 90% by its end.
+CardStats = namedtuple(
+  'CardStats',
+  ['reviews', 'lapses', 'retention', 'last_review', 'stability'])
+
+
+def retrievability(stats, now_ms):
+  """Returns the estimated probability of recalling a card at `now_ms`.
+
+  Uses the forgetting curve of FSRS, (1 + t / 9S)^-1, which is 0.9 after
+  the stability S. Cards without reviews score 0.
+  """
+  if stats is None or stats.stability <= 0:
+    return 0.0
+  elapsed = max(now_ms - stats.last_review, 0) / _MS_PER_DAY
+  return 1.0 / (1.0 + elapsed / (9.0 * stats.stability))
+
+
+def _known_item(deck_name, note):
+  """Returns the known character/word of a note, or None if it has none."""
+  field = WORD_FIELDS[deck_name]
+  # Skip legacy front/back cards in the general deck.
+  if len(note) <= field:
+    return None
+  # A lot of general notes lack a character in the 'back' slot, skip those.
+  if deck_name == GENERAL_DECK and not note[field]:
+    return None
+  return note[field]
+
+
+def _sorted_contains(values, value):
+  i = bisect.bisect_left(values, value)
+  return i < len(values) and values[i] == value
+
 
 class AnkiReader:
-  def __init__(self, collection_path):
+  def __init__(self, collection_path, index_notes=False,
+               known_cache_path=None, decks=None, note_search_path=None):
+    """Opens the collection read only.
+
+    If `index_notes` is set, all notes of the character and word decks are
+    read up front and indexed by their word, see build_note_index(). This
+    suits callers looking up many words.
+
+    If `known_cache_path` is set, the known characters and words are kept in
+    a cache file there, and only notes changed since the cache was written
+    are read from the collection, see get_known_characters().
+
+    `decks` is the deck map of another reader of the same collection, to
+    save reading it again.
+
+    If `note_search_path` is set, the notes of the character and word decks
+    are mirrored to a side database there, see common.note_search, and card
+    lookups and search_notes() use its indexes.
+    """
     db_uri = 'file:{}?mode=ro'.format(collection_path)
-    self.conn = sqlite3.connect(db_uri, uri=True)
+    # Readers may be shared between threads through a common.pool.Pool,
+    # which only hands them to one thread at a time.
+    self.conn = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
     self.c = self.conn.cursor()
 
     # Read the decks in the table.
-    self.decks = {}
-    for row in self.c.execute('SELECT * FROM decks'):
-      name = row[1]
-      deck_id = int(row[0])
-      self.decks[name] = deck_id
-    print(self.decks)
+    if decks is None:
+      decks = {}
+      for row in self.c.execute('SELECT * FROM decks'):
+        name = row[1]
+        deck_id = int(row[0])
+        decks[name] = deck_id
+      logging.info('Anki decks: {}'.format(decks))
+    self.decks = decks
+
+    self.known_cache_path = known_cache_path
+    # Map from deck name to a tuple of the packed array('q') of note ids in
+    # the deck, and the list of their known items (None for notes without
+    # one), set by _sync_known_cache().
+    self._known_notes = None
+
+    # Maps from deck name to a map from word to the notes for that word,
+    # set by build_note_index().
+    self.note_index = None
+    if index_notes:
+      self.build_note_index()
+
+    self.note_search = None
+    if note_search_path is not None:
+      self.note_search = NoteSearch(
+        note_search_path, self.conn,
+        [self.decks[name] for name in WORD_FIELDS])
+
+  def build_note_index(self):
+    """Reads the notes of the character and word decks in one query.
+
+    Afterwards, get_character_cards(), get_legacy_word_cards() and
+    get_word_cards() are dict lookups instead of a scan of the notes table.
+    """
+    word_fields = {self.decks[name]: field
+                   for name, field in WORD_FIELDS.items()}
+    index = {deck_id: {} for deck_id in word_fields}
+    for deck_id, _, flds in self.c.execute(
+        'SELECT DISTINCT cards.did, notes.id, notes.flds FROM cards '
+        'JOIN notes ON notes.id=cards.nid WHERE cards.did IN (?, ?, ?) '
+        'ORDER BY notes.id', list(word_fields)):
+      note = flds.split(u'\u001f')
+      field = word_fields[deck_id]
+      # Skip legacy front/back cards in the general deck.
+      if len(note) <= field:
+        continue
+      index[deck_id].setdefault(note[field], []).append(note)
+    self.note_index = {name: index[deck_id]
+                       for name, deck_id in self.decks.items()
+                       if deck_id in index}
+
+  def _indexed_notes(self, deck_name, word):
+    if self.note_index is not None:
+      return list(self.note_index[deck_name].get(word, ()))
+    return self.note_search.find(
+      self.decks[deck_name], WORD_FIELDS[deck_name], word)
+
+  def search_notes(self, substring, limit=None):
+    """Returns notes of the character and word decks containing `substring`
+    in their word field.
+
+    Args:
+      substring: The substring to look for.
+      limit: If set, the maximum number of notes to return from each deck.
+
+    Returns:
+      A list of tuples (deck name, note), by deck and then note id.
+    """
+    results = []
+    for name, field in WORD_FIELDS.items():
+      deck_id = self.decks[name]
+      if self.note_search is not None:
+        notes = [note for _, note in self.note_search.search(
+          [deck_id], substring, field, limit)]
+      else:
+        notes = []
+        for flds, in self.c.execute(
+            'SELECT flds FROM notes WHERE flds LIKE ? AND id IN '
+            '(SELECT nid FROM cards WHERE did=?) ORDER BY id', (
+              '%' + substring + '%', deck_id)):
+          note = flds.split(u'\u001f')
+          if len(note) > field and substring in note[field]:
+            notes.append(note)
+            if len(notes) == limit:
+              break
+      results.extend((name, note) for note in notes)
+    return results
 
   def get_notes(self, deck_name):
     deck_id = self.decks[deck_name]
@@ -30,19 +202,246 @@ class AnkiReader:
       notes.append(row[0].split(u'\u001f'))
     return notes
 
+  def _load_known_cache(self):
+    try:
+      with open(self.known_cache_path, 'rb') as f:
+        cache = marshal.loads(f.read())
+    except (FileNotFoundError, EOFError, ValueError, TypeError):
+      return None
+    if cache.get('version') != KNOWN_CACHE_VERSION:
+      return None
+    return cache
+
+  def _write_known_cache(self, cache):
+    tmp_path = '{}.tmp.{}'.format(self.known_cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      f.write(marshal.dumps(cache))
+    os.replace(tmp_path, self.known_cache_path)
+
+  def _sync_known_cache(self):
+    """Brings the cache of known items up to date with the collection.
+
+    If the collection's mod and usn are unchanged since the cache was
+    written, nothing else is read. Otherwise only notes and cards modified
+    since the last sync are read. A deck's note ids are only scanned in full
+    if its number of notes does not match the cache after applying those
+    changes, e.g. after notes were deleted.
+    """
+    if self._known_notes is not None:
+      return
+    cache = self._load_known_cache()
+    col_state = list(self.c.execute('SELECT mod, usn FROM col').fetchone())
+    if cache is not None and cache['col'] == col_state:
+      self._known_notes = cache['decks']
+      return
+    if cache is None:
+      cache = {'note_mod': 0, 'card_mod': 0, 'decks': {}}
+
+    # Notes and cards changed in the same second as the last sync have the
+    # same mod, so they are read again.
+    note_mod = cache['note_mod']
+    changed_notes = {}
+    for nid, flds, mod in self.c.execute(
+        'SELECT id, flds, mod FROM notes WHERE mod>=?', (cache['note_mod'],)):
+      changed_notes[nid] = flds
+      note_mod = max(note_mod, mod)
+    changed_cards = []
+    if cache['decks']:
+      card_mod = cache['card_mod']
+      for nid, did, mod in self.c.execute(
+          'SELECT nid, did, mod FROM cards WHERE mod>=?', (card_mod,)):
+        changed_cards.append((nid, did))
+        card_mod = max(card_mod, mod)
+    else:
+      # All decks are scanned in full below.
+      card_mod = self.c.execute(
+        'SELECT COALESCE(MAX(mod), 0) FROM cards').fetchone()[0]
+    # The decks of all cards of notes with changed cards.
+    note_decks = self._note_decks({nid for nid, _ in changed_cards})
+    deck_ids = [self.decks[name] for name in WORD_FIELDS]
+    deck_sizes = dict(self.c.execute(
+      'SELECT did, COUNT(DISTINCT nid) FROM cards WHERE did IN ({}) '
+      'GROUP BY did'.format(','.join('?' * len(deck_ids))), deck_ids))
+
+    decks = {}
+    for name in WORD_FIELDS:
+      deck_id = self.decks[name]
+      cached_nids, cached_items = cache['decks'].get(name, (b'', []))
+      nids = array('q')
+      nids.frombytes(cached_nids)
+
+      # Notes whose cards changed may have moved in to or out of the deck.
+      added = removed = set()
+      if name in cache['decks']:
+        touched = {nid for nid, did in changed_cards
+                   if did == deck_id or _sorted_contains(nids, nid)}
+        in_deck = {nid for nid in touched if deck_id in note_decks[nid]}
+        added = {nid for nid in in_deck if not _sorted_contains(nids, nid)}
+        removed = {nid for nid in touched - in_deck
+                   if _sorted_contains(nids, nid)}
+      if (name not in cache['decks'] or
+          len(nids) + len(added) - len(removed) != deck_sizes.get(deck_id, 0)):
+        nids = array('q', itertools.chain.from_iterable(self.c.execute(
+          'SELECT DISTINCT nid FROM cards WHERE did=? ORDER BY nid',
+          (deck_id,))))
+      elif added or removed:
+        nids = array('q', sorted((set(nids) - removed) | added))
+      else:
+        # Same notes as before, only update the changed ones.
+        items = list(cached_items)
+        for nid, flds in changed_notes.items():
+          i = bisect.bisect_left(nids, nid)
+          if i < len(nids) and nids[i] == nid:
+            items[i] = _known_item(name, flds.split(u'\u001f'))
+        decks[name] = (cached_nids, items)
+        continue
+      items = self._merge_known_items(
+        name, nids, cached_nids, cached_items, changed_notes)
+      decks[name] = (nids.tobytes(), items)
+
+    self._known_notes = decks
+    self._write_known_cache({
+      'version': KNOWN_CACHE_VERSION,
+      'col': col_state,
+      'note_mod': note_mod,
+      'card_mod': card_mod,
+      'decks': decks,
+    })
+
+  def _note_decks(self, nids):
+    """Returns a map from each of the note ids `nids` to its set of decks."""
+    nids = list(nids)
+    result = {nid: set() for nid in nids}
+    for i in range(0, len(nids), _FETCH_BATCH):
+      batch = nids[i:i + _FETCH_BATCH]
+      for nid, did in self.c.execute(
+          'SELECT nid, did FROM cards WHERE nid IN ({})'.format(
+            ','.join('?' * len(batch))), batch):
+        result[nid].add(did)
+    return result
+
+  def _merge_known_items(self, deck_name, nids, cached_nids, cached_items,
+                         changed):
+    """Returns the known items of notes `nids`, for a deck whose notes changed.
+
+    Items come from `changed` notes, then from the cache, and the remaining
+    notes (unchanged notes whose cards moved in to the deck) are read.
+    """
+    cached_ids = array('q')
+    cached_ids.frombytes(cached_nids)
+    cached = dict(zip(cached_ids, cached_items))
+    items = []
+    missing = {}
+    for nid in nids:
+      if nid in changed:
+        items.append(_known_item(deck_name, changed[nid].split(u'\u001f')))
+      elif nid in cached:
+        items.append(cached[nid])
+      else:
+        missing[nid] = len(items)
+        items.append(None)
+    missing_ids = list(missing)
+    for i in range(0, len(missing_ids), _FETCH_BATCH):
+      batch = missing_ids[i:i + _FETCH_BATCH]
+      for nid, flds in self.c.execute(
+          'SELECT id, flds FROM notes WHERE id IN ({})'.format(
+            ','.join('?' * len(batch))), batch):
+        items[missing[nid]] = _known_item(deck_name, flds.split(u'\u001f'))
+    return items
+
+  def _get_known_items(self, deck_name):
+    self._sync_known_cache()
+    return [item for item in self._known_notes[deck_name][1]
+            if item is not None]
+
+  def get_card_stats(self):
+    """Returns the review history of the cards of the word decks.
+
+    The revlog is aggregated per card by sqlite in one pass, so memory only
+    grows with the number of cards, not of reviews.
+
+    Returns:
+      A map from card id to CardStats, for cards with at least one review.
+    """
+    deck_ids = [self.decks[name] for name in WORD_FIELDS]
+    stats = {}
+    for cid, reviews, lapses, last_review, ivl in self.c.execute(
+        'SELECT r.cid, r.reviews, r.lapses, r.last_id, revlog.ivl FROM ('
+        '  SELECT cid, SUM(type=?) AS reviews,'
+        '    SUM(type=? AND ease=1) AS lapses, MAX(id) AS last_id'
+        '  FROM revlog WHERE type IN ({}) AND cid IN'
+        '    (SELECT id FROM cards WHERE did IN ({}))'
+        '  GROUP BY cid) AS r '
+        'JOIN revlog ON revlog.id=r.last_id'.format(
+          ','.join('?' * len(_REVLOG_MEMORY_TYPES)),
+          ','.join('?' * len(deck_ids))),
+        [_REVLOG_REVIEW, _REVLOG_REVIEW] + list(_REVLOG_MEMORY_TYPES) +
+        deck_ids):
+      # Negative intervals are learning steps, in seconds.
+      stability = ivl if ivl >= 0 else -ivl / (24 * 60 * 60)
+      retention = (reviews - lapses) / reviews if reviews else None
+      stats[cid] = CardStats(reviews, lapses, retention, last_review,
+                             stability)
+    return stats
+
+  def get_known_scores(self, now_ms=None):
+    """Returns how well each known character and word is remembered.
+
+    The score of a note is the mean retrievability() of its cards, and the
+    score of an item with several notes is the best of those.
+
+    Args:
+      now_ms: Time to score at, in ms since the epoch. Defaults to now.
+
+    Returns:
+      A map from deck name in WORD_FIELDS to a map from each known item in
+      that deck to its score between 0 and 1.
+    """
+    if now_ms is None:
+      now_ms = int(time.time() * 1000)
+    card_stats = self.get_card_stats()
+    deck_names = {self.decks[name]: name for name in WORD_FIELDS}
+    # Map from deck and note id to deck name, item, and the sum and count of
+    # card scores.
+    notes = {}
+    for did, nid, cid, flds in self.c.execute(
+        'SELECT cards.did, cards.nid, cards.id, notes.flds FROM cards '
+        'JOIN notes ON notes.id=cards.nid WHERE cards.did IN ({})'.format(
+          ','.join('?' * len(deck_names))), list(deck_names)):
+      score = retrievability(card_stats.get(cid), now_ms)
+      note = notes.get((did, nid))
+      if note is None:
+        name = deck_names[did]
+        item = _known_item(name, flds.split(u'\u001f'))
+        notes[did, nid] = [name, item, score, 1]
+      else:
+        note[2] += score
+        note[3] += 1
+    scores = {name: {} for name in WORD_FIELDS}
+    for name, item, total, count in notes.values():
+      if item is None:
+        continue
+      deck_scores = scores[name]
+      deck_scores[item] = max(deck_scores.get(item, 0.0), total / count)
+    return scores
+
   def get_known_characters(self):
-    char_notes = self.get_notes(u'Chinese\x1fCharacters')
+    if self.known_cache_path is not None:
+      return self._get_known_items(CHARACTERS_DECK)
+    char_notes = self.get_notes(CHARACTERS_DECK)
     chars = []
     for note in char_notes:
       chars.append(note[0])
     return chars
 
   def get_character_cards(self, char):
+    if self.note_index is not None or self.note_search is not None:
+      return self._indexed_notes(CHARACTERS_DECK, char)
     notes = []
     for row in self.c.execute(
       'SELECT flds FROM notes WHERE flds LIKE ? AND id IN'
       '(SELECT nid FROM cards WHERE did=?)', (
-        "%" + char + "%", self.decks[u'Chinese\x1fCharacters'])):
+        "%" + char + "%", self.decks[CHARACTERS_DECK])):
       note = row[0].split(u'\u001f')
       if note[0] == char:
         notes.append(note)
@@ -50,25 +449,31 @@ class AnkiReader:
 
 
   def get_known_legacy_words(self):
-    word_notes = self.get_notes(u'Chinese\x1fWords')
+    if self.known_cache_path is not None:
+      return self._get_known_items(LEGACY_WORDS_DECK)
+    word_notes = self.get_notes(LEGACY_WORDS_DECK)
     words = []
     for note in word_notes:
       words.append(note[0])
     return words
 
   def get_legacy_word_cards(self, word):
+    if self.note_index is not None or self.note_search is not None:
+      return self._indexed_notes(LEGACY_WORDS_DECK, word)
     notes = []
     for row in self.c.execute(
       'SELECT flds FROM notes WHERE flds LIKE ? AND id IN'
       '(SELECT nid FROM cards WHERE did=?)', (
-        "%" + word + "%", self.decks[u'Chinese\x1fWords'])):
+        "%" + word + "%", self.decks[LEGACY_WORDS_DECK])):
       note = row[0].split(u'\u001f')
       if note[0] == word:
         notes.append(note)
     return notes
 
   def get_known_words(self):
-    word_notes = self.get_notes(u'Chinese\x1fGeneral')
+    if self.known_cache_path is not None:
+      return list(set(self._get_known_items(GENERAL_DECK)))
+    word_notes = self.get_notes(GENERAL_DECK)
     words = []
     for note in word_notes:
       # Skip legacy front/back cards.
@@ -82,11 +487,13 @@ class AnkiReader:
     return words
 
   def get_word_cards(self, word):
+    if self.note_index is not None or self.note_search is not None:
+      return self._indexed_notes(GENERAL_DECK, word)
     notes = []
     for row in self.c.execute(
         'SELECT flds FROM notes WHERE flds LIKE ? AND id IN '
         '(SELECT nid FROM cards WHERE did=?)', (
-          "%" + word + "%", self.decks[u'Chinese\x1fGeneral'])):
+          "%" + word + "%", self.decks[GENERAL_DECK])):
       note = row[0].split(u'\u001f')
       if len(note) == 2:
         continue
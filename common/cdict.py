@@ -3,21 +3,48 @@
 
 Data comes from CC-CEDICT as well as a character frequency table.
 
-TODO(piotrf): consider building a sql database for the dictionary, with this
-file turned in to a script to pull together data sources to recreate the db.
+See sqlite_dict.SqliteDict for a version of the dictionary backed by a sql
+database, built from the same data sources by build_dict_db.py.
 """
 
-from dataclasses import dataclass, field
+from array import array
+from collections.abc import Mapping, Sequence
+import itertools
 import logging
 import re
 import os
+import sys
+import threading
 from typing import List
 
+from common import snapshot
+from common.english_index import EnglishIndex
+from common.substring_index import SubstringIndex
+
 CEDICT_FILE = 'cedict_ts.u8'
 CHAR_FREQUENCY_FILE = 'characters_by_frequency.txt'
 WORD_FREQUENCY_FILE = 'words_by_frequency.csv'
 HSK_CHARS_FILE = 'hsk_chars.txt'
 HSK_WORDS_FILE = 'hsk_words.txt'
+SOURCE_FILES = [CEDICT_FILE, CHAR_FREQUENCY_FILE, WORD_FREQUENCY_FILE,
+                HSK_CHARS_FILE, HSK_WORDS_FILE]
+
+# Data layers loaded on top of CC-CEDICT, which may be deferred until first
+# use, see Dict.__init__.
+CHAR_FREQUENCY_LAYER = 'char_frequencies'
+WORD_FREQUENCY_LAYER = 'word_frequencies'
+HSK_CHARS_LAYER = 'hsk_chars'
+HSK_WORDS_LAYER = 'hsk_words'
+LAYERS = [CHAR_FREQUENCY_LAYER, WORD_FREQUENCY_LAYER, HSK_CHARS_LAYER,
+          HSK_WORDS_LAYER]
+
+# Binary snapshot of a fully loaded Dict, see Dict.build_snapshot().
+SNAPSHOT_FILE = 'cdict.snapshot'
+SNAPSHOT_KIND = 'cdict'
+SNAPSHOT_VERSION = 4
+
+# Snapshot of the english meaning index, see Dict.english_index.
+ENGLISH_INDEX_FILE = 'cdict_english.snapshot'
 
 
 def _tone_diacritic(tone):
@@ -47,14 +74,62 @@ def _find_first(string, characters):
   return -1
 
 
+def _convert_syllable(w):
+  """Returns a single tone-numbered syllable with diacritics."""
+  # Convert 'u:' to umlaut.
+  if 'u:' in w:
+    parts = w.split('u:')
+    w = parts[0] + u'\u00fc' + parts[1]
+  # Convert tone number to diacritic.
+  if w[-1].isdigit():
+    tone = _tone_diacritic(w[-1])
+    if 'iu' in w:
+      i = w.index('iu') + 1
+    else:
+      i = _find_first(w, ['a', 'A', 'o', 'O', 'e', 'E', 'i', 'I', 'u', 'U',
+                         u'\u00fc', u'\u00dc'])
+    # We expect that a vowel exists for a valid chinese word.
+    assert i != -1, 'No vowel in pinyin syllable {!r}'.format(w)
+    w = w[0:i+1] + tone + w[i+1:-1]
+  return w
+
+
+# Syllables without valid pronunciations, which are left as is.
+_UNCONVERTED_SYLLABLES = frozenset(['xx5', 'm2', 'm4'])
+
+_INITIALS = ['', 'b', 'p', 'm', 'f', 'd', 't', 'n', 'l', 'g', 'k', 'h', 'j',
+             'q', 'x', 'zh', 'ch', 'sh', 'r', 'z', 'c', 's', 'y', 'w']
+_FINALS = ['a', 'o', 'e', 'ai', 'ei', 'ao', 'ou', 'an', 'en', 'ang', 'eng',
+           'ong', 'er', 'i', 'ia', 'ie', 'iao', 'iu', 'ian', 'in', 'iang',
+           'ing', 'iong', 'u', 'ua', 'uo', 'uai', 'ui', 'uan', 'un', 'uang',
+           'ue', 'u:', 'u:e', 'u:an', 'u:n']
+
+
+def _build_syllable_table():
+  # Every initial/final combination in all five tones, lower case and
+  # capitalized as in proper nouns. This over-covers the ~1,600 Mandarin
+  # syllables, which is harmless since the extra keys are never looked up.
+  table = {}
+  for initial in _INITIALS:
+    for final in _FINALS:
+      for syllable in (initial + final, (initial + final).capitalize()):
+        for tone in '12345':
+          table[syllable + tone] = _convert_syllable(syllable + tone)
+  for syllable in _UNCONVERTED_SYLLABLES:
+    table[syllable] = syllable
+  return table
+
+
+# Map from a tone-numbered syllable to its diacritic form. Syllables missing
+# from the table (letters, punctuation, rare readings) are converted once and
+# then added.
+_SYLLABLE_DIACRITICS = _build_syllable_table()
+
+
 def pinyin_diacritic(pinyin):
   """Returns pinyin with diacritics."""
   result = []
   for w in pinyin.split():
-    # Don't do anything for words without valid pronunciations.
-    if w in ['xx5', 'm2', 'm4']:
-      result.append(w)
-      continue
     # Handle retroflex r appended on previous symbol.
     if w == 'r5':
       if len(result):
@@ -62,88 +137,362 @@ def pinyin_diacritic(pinyin):
       else:
         result.append('r')
       continue
-    # Convert 'u:' to umlaut.
-    if 'u:' in w:
-      parts = w.split('u:')
-      w = parts[0] + u'\u00fc' + parts[1]
-    # Convert tone number to diacritic.
-    if w[-1].isdigit():
-      tone = _tone_diacritic(w[-1])
-      if 'iu' in w:
-        i = w.index('iu') + 1
-      else:
-        i = _find_first(w, ['a', 'A', 'o', 'O', 'e', 'E', 'i', 'I', 'u', 'U',
-                           u'\u00fc', u'\u00dc'])
-      # We expect that a vowel exists for a valid chinese word.
-      if i == -1:
-        print(pinyin)
-        print(w)
-      assert i != -1
-      w = w[0:i+1] + tone + w[i+1:-1]
-    result.append(w)
+    converted = _SYLLABLE_DIACRITICS.get(w)
+    if converted is None:
+      converted = _convert_syllable(w)
+      _SYLLABLE_DIACRITICS[w] = converted
+    result.append(converted)
   return ' '.join(result)
 
 
-def _meaning_importance(entry):
-  if entry.meaning.startswith(u'variant'):
+def pinyin_diacritic_batch(pinyins):
+  """Returns pinyin_diacritic() of each of the given pinyin strings.
+
+  Repeated strings are only converted once, which makes converting the
+  pinyin of many entries much cheaper than calling pinyin_diacritic() on each.
+  """
+  converted = {}
+  result = []
+  for pinyin in pinyins:
+    diacritic = converted.get(pinyin)
+    if diacritic is None:
+      diacritic = pinyin_diacritic(pinyin)
+      converted[pinyin] = diacritic
+    result.append(diacritic)
+  return result
+
+
+def _meaning_importance(meaning):
+  if meaning.startswith(u'variant'):
     return 1
-  elif entry.meaning.startswith(u'old variant'):
+  elif meaning.startswith(u'old variant'):
     return 2
-  elif entry.meaning.startswith(u'archaic variant'):
+  elif meaning.startswith(u'archaic variant'):
     return 3
   else:
     return -1
 
 
-@dataclass
-class MeaningEntry(object):
-  # The pinyin for this word/character, with the tones indicated by numbers.
-  pinyin: str
+class MeaningTable:
+  """Meanings of many entries, stored in shared parallel lists.
+
+  A DictEntry refers to its meanings as a [start, stop) range of this table,
+  so a loaded dictionary has no per-meaning objects. Pinyin strings are
+  interned, since the same readings are shared by many entries. Their
+  diacritic forms are converted when a meaning's is first asked for, and
+  then cached by index, see MeaningEntry.pinyin_diacritic.
+  """
+  __slots__ = ('pinyins', 'meanings', '_diacritics')
+
+  def __init__(self):
+    self.pinyins = []
+    self.meanings = []
+    # Map from the index of a meaning to its pinyin with diacritics.
+    self._diacritics = {}
+
+  def __len__(self):
+    return len(self.pinyins)
+
+  def extend(self, pinyins, meanings):
+    """Appends parallel pinyins and meanings, and returns their range."""
+    start = len(self.pinyins)
+    self.pinyins.extend(sys.intern(p) for p in pinyins)
+    self.meanings.extend(meanings)
+    assert len(self.pinyins) == len(self.meanings)
+    return start, len(self.pinyins)
+
+  def pinyin_diacritic(self, i):
+    """Returns the pinyin of meaning `i` with diacritics."""
+    diacritic = self._diacritics.get(i)
+    if diacritic is None:
+      diacritic = pinyin_diacritic(self.pinyins[i])
+      self._diacritics[i] = diacritic
+    return diacritic
 
-  # The dictionary meaning for this word/character, in English.
-  meaning: str
+
+# Table shared by all entries without meanings.
+_EMPTY_TABLE = MeaningTable()
+
+
+class MeaningEntry:
+  __slots__ = ('pinyin', 'meaning', '_pinyin_diacritic', '_table', '_index')
+
+  def __init__(self, pinyin: str, meaning: str, pinyin_diacritic: str = None,
+               table: MeaningTable = None, index: int = 0):
+    # The pinyin for this word/character, with the tones indicated by numbers.
+    self.pinyin = pinyin
+
+    # The dictionary meaning for this word/character, in English.
+    self.meaning = meaning
+
+    # Cached diacritic form of `pinyin`, converted on first use if None.
+    self._pinyin_diacritic = pinyin_diacritic
+
+    # The MeaningTable and index this meaning was read from, if any, which
+    # caches the diacritic form for later reads of the same meaning.
+    self._table = table
+    self._index = index
 
   # Same as `pinyin`, but with the tone indicated by a diacritic over the
   # letters.
   @property
   def pinyin_diacritic(self) -> str:
-    return pinyin_diacritic(self.pinyin)
+    if self._pinyin_diacritic is None:
+      if self._table is None:
+        self._pinyin_diacritic = pinyin_diacritic(self.pinyin)
+      else:
+        self._pinyin_diacritic = self._table.pinyin_diacritic(self._index)
+    return self._pinyin_diacritic
 
-    
-@dataclass
-class DictEntry:
-  # The word/character this entry represents.
-  word: str
+  def __eq__(self, other):
+    if not isinstance(other, MeaningEntry):
+      return NotImplemented
+    return self.pinyin == other.pinyin and self.meaning == other.meaning
 
-  # The same word/character in traditional.
-  traditional: str
+  def __repr__(self):
+    return 'MeaningEntry(pinyin={!r}, meaning={!r})'.format(
+      self.pinyin, self.meaning)
+
+
+class MeaningList(Sequence):
+  """Read-only view of the meanings of one entry in a MeaningTable."""
+  __slots__ = ('_table', '_start', '_stop')
+
+  def __init__(self, table, start, stop):
+    self._table = table
+    self._start = start
+    self._stop = stop
+
+  def __len__(self):
+    return self._stop - self._start
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [self[j] for j in range(*i.indices(len(self)))]
+    n = self._stop - self._start
+    if i < 0:
+      i += n
+    if not 0 <= i < n:
+      raise IndexError('meaning index out of range')
+    i += self._start
+    table = self._table
+    return MeaningEntry(table.pinyins[i], table.meanings[i],
+                        table._diacritics.get(i), table, i)
+
+  def __eq__(self, other):
+    if not isinstance(other, (MeaningList, list)):
+      return NotImplemented
+    return list(self) == list(other)
+
+  def __repr__(self):
+    return repr(list(self))
+
+
+class DictEntry:
+  __slots__ = ('word', 'traditional', '_table', '_start', '_stop',
+               'char_frequency', 'word_frequency', 'char_hsk_level',
+               'word_hsk_level')
+
+  def __init__(self, word: str, traditional: str,
+               meanings: List[MeaningEntry] = (),
+               char_frequency: float = 0.0, word_frequency: float = 0.0,
+               char_hsk_level: int = 0, word_hsk_level: int = 0):
+    # The word/character this entry represents.
+    self.word = word
+
+    # The same word/character in traditional. Shares the string with `word`
+    # when both are the same.
+    self.traditional = word if traditional == word else traditional
+
+    # The meanings of this entry, see `meanings`. Entries made without
+    # meanings get theirs set later, by the loaders.
+    if meanings:
+      self.meanings = meanings
+    else:
+      self._set_meaning_range(_EMPTY_TABLE, 0, 0)
+
+    # If >0, the relative frequency of this character from a corpus of
+    # written Chinese.
+    self.char_frequency = char_frequency
+
+    # If >0, the relative frequency of this word from a corpus of
+    # written Chinese. Note that the frequency of a character as word is
+    # distinct from the frequency of it appearing as a character.
+    self.word_frequency = word_frequency
+
+    # HSK level for this entry as a character. 1 through 6.
+    # If 0, then this is not any HSK list.
+    self.char_hsk_level = char_hsk_level
+
+    # HSK level for this entry as a word. 1 through 6.
+    # If 0, then this is not any HSK list.
+    self.word_hsk_level = word_hsk_level
 
   # A list of different meanings from CC-CEDICT.
-  meanings: List[MeaningEntry] = field(default_factory=list)
+  @property
+  def meanings(self) -> MeaningList:
+    return MeaningList(self._table, self._start, self._stop)
+
+  @meanings.setter
+  def meanings(self, meanings):
+    if not meanings:
+      self._set_meaning_range(_EMPTY_TABLE, 0, 0)
+      return
+    table = MeaningTable()
+    self._table = table
+    self._start, self._stop = table.extend(
+      [m.pinyin for m in meanings], [m.meaning for m in meanings])
+
+  def _set_meaning_range(self, table, start, stop):
+    self._table = table
+    self._start = start
+    self._stop = stop
+
+  def __eq__(self, other):
+    if not isinstance(other, DictEntry):
+      return NotImplemented
+    return (self.word == other.word and
+            self.traditional == other.traditional and
+            self.meanings == other.meanings and
+            self.char_frequency == other.char_frequency and
+            self.word_frequency == other.word_frequency and
+            self.char_hsk_level == other.char_hsk_level and
+            self.word_hsk_level == other.word_hsk_level)
+
+  def __repr__(self):
+    return ('DictEntry(word={!r}, traditional={!r}, meanings={!r}, '
+            'char_frequency={!r}, word_frequency={!r}, char_hsk_level={!r}, '
+            'word_hsk_level={!r})').format(
+              self.word, self.traditional, list(self.meanings),
+              self.char_frequency, self.word_frequency, self.char_hsk_level,
+              self.word_hsk_level)
+
+
+class _CharToWords(Mapping):
+  """Read-only map from a character to the (word, rank) of frequency list
+  words containing it, backed by a SubstringIndex."""
+
+  def __init__(self, d):
+    self._d = d
+
+  def __getitem__(self, char):
+    words = [w for w in self._d.word_index.search(char) if w[1]]
+    if not words:
+      raise KeyError(char)
+    return words
+
+  def __iter__(self):
+    for char in self._d.word_index.postings:
+      if char in self:
+        yield char
+
+  def __len__(self):
+    return sum(1 for _ in self)
+
+  def __contains__(self, char):
+    index = self._d.word_index
+    return any(index.ranks[i] for i in index.postings.get(char, ()))
+
+
+class _SnapshotColumns:
+  """Entries of a snapshot, made from its columns on first access.
+
+  The columns are unmarshalled when the first entry is looked up, and each
+  DictEntry is only made the first time it is returned. Entries are kept, so
+  both views below return the same objects.
+  """
 
-  # If >0, the relative frequency of this character from a corpus of
-  # written Chinese.
-  char_frequency: float = 0.0
+  def __init__(self, sections, table):
+    self._sections = sections
+    self._table = table
+    self._lock = threading.Lock()
+    self._entries = None
+    # Map from a view key, 'word' or 'traditional', to a map from that form
+    # of each word to its position.
+    self._positions = {}
+
+  def _load(self):
+    sections = self._sections
+    self._words = sections['words']
+    # Traditional forms equal to the word are stored as ''.
+    self._traditional = sections['traditional']
+    meaning_counts = array('I')
+    meaning_counts.frombytes(sections['meaning_counts'])
+    self._meaning_starts = array(
+      'I', itertools.accumulate(meaning_counts, initial=0))
+    self._char_frequency = array('d')
+    self._char_frequency.frombytes(sections['char_frequency'])
+    self._word_frequency = array('d')
+    self._word_frequency.frombytes(sections['word_frequency'])
+    self._char_hsk_level = sections['char_hsk_level']
+    self._word_hsk_level = sections['word_hsk_level']
+    self._table.pinyins = sections['pinyins']
+    self._table.meanings = sections['meanings']
+    self._entries = [None] * len(self._words)
+
+  def positions(self, key):
+    with self._lock:
+      positions = self._positions.get(key)
+      if positions is None:
+        if self._entries is None:
+          self._load()
+        if key == 'word':
+          words = self._words
+        else:
+          words = [t or w for w, t in zip(self._words, self._traditional)]
+        # Like Dict.load_cedict(), the last entry with a key wins.
+        positions = dict(zip(words, range(len(words))))
+        self._positions[key] = positions
+      return positions
 
-  # If >0, the relative frequency of this word from a corpus of
-  # written Chinese. Note that the frequency of a character as word is
-  # distinct from the frequency of it appearing as a character.
-  word_frequency: float = 0.0
+  def entry(self, i):
+    with self._lock:
+      entry = self._entries[i]
+      if entry is None:
+        word = self._words[i]
+        entry = DictEntry(word, self._traditional[i] or word, (),
+                          self._char_frequency[i], self._word_frequency[i],
+                          self._char_hsk_level[i], self._word_hsk_level[i])
+        entry._set_meaning_range(self._table, self._meaning_starts[i],
+                                 self._meaning_starts[i + 1])
+        self._entries[i] = entry
+      return entry
 
-  # HSK level for this entry as a character. 1 through 6.
-  # If 0, then this is not any HSK list.
-  char_hsk_level: int = 0
 
-  # HSK level for this entry as a word. 1 through 6.
-  # If 0, then this is not any HSK list.
-  word_hsk_level: int = 0
+class _SnapshotEntryView(Mapping):
+  """Read-only mapping from a word (or traditional word) to a DictEntry."""
+
+  def __init__(self, columns, key):
+    self._columns = columns
+    self._key = key
+
+  def __getitem__(self, key):
+    return self._columns.entry(self._columns.positions(self._key)[key])
+
+  def __contains__(self, key):
+    return key in self._columns.positions(self._key)
+
+  def __iter__(self):
+    return iter(self._columns.positions(self._key))
+
+  def __len__(self):
+    return len(self._columns.positions(self._key))
+
+  def items(self):
+    for key, i in self._columns.positions(self._key).items():
+      yield key, self._columns.entry(i)
+
+  def values(self):
+    for _, entry in self.items():
+      yield entry
+
 
-  
 class Dict:
   """A dictionary for Chinese words and characters.
 
   Attributes:
-    entries: A map from character/word to a DictEntry.
+    entries: A map from character/word to a DictEntry. For a Dict loaded from
+      a snapshot, this is a read-only mapping making entries on first access.
     traditional_to_entry: Like entries, except from traditional to DictEntry.
     chars_by_frequency: A list of chinese characters, in order from most
       to least frequent.
@@ -151,68 +500,277 @@ class Dict:
     hsk_words: Similar to `hsk_chars`, but for words. Note that the HSK word
       lists do also include single character words, though not every character
       in `hsk_chars` also appears in `hsk_words`.
-    char_to_words: Map from a character to a list of tuples (word, frequency),
-      where frequency is given as the index in the sorted word frequency list.
+    word_index: SubstringIndex over the words of the word frequency list, in
+      frequency order, followed by the remaining CC-CEDICT words.
+    char_to_words: Read-only map from a character to a list of tuples
+      (word, frequency) of the frequency list words containing it, where
+      frequency is given as the index in the sorted word frequency list.
+    meaning_table: MeaningTable holding the meanings of all entries.
+    english_index: EnglishIndex over the meanings of all entries, loaded or
+      built on first use.
   """
 
-  def __init__(self, data_dir):
+  def __init__(self, data_dir=None, defer=()):
+    """Loads the dictionary from the source files in `data_dir`.
+
+    CC-CEDICT is loaded first, then the other layers, see LAYERS.
+
+    Args:
+      data_dir: Directory with the dictionary source files. If None, the
+        dictionary is empty.
+      defer: Layers to only load on first access of the attribute they fill:
+        `chars_by_frequency`, `word_index`/`char_to_words`, `hsk_chars` and
+        `hsk_words`. The entry fields set by a deferred layer stay 0 until
+        then, see load_deferred().
+    """
+    self.data_dir = data_dir
+    self.meaning_table = MeaningTable()
     self.entries = {}
     self.traditional_to_entry = {}
-    self.chars_by_frequency = []
-    self.hsk_chars = []
-    self.hsk_words = []
-    self.char_to_words = {}
-    
+    self._chars_by_frequency = []
+    self._hsk_chars = []
+    self._hsk_words = []
+    self._word_index = SubstringIndex([], array('I'))
+    self.char_to_words = _CharToWords(self)
+    self._english_index = None
+    # (word, rank) of the word frequency list, see build_word_index().
+    self._frequency_words = []
+    # Map from a layer that is not loaded yet to the function loading it.
+    self._pending_layers = {}
+    self._loading_layers = set()
+    self._layer_locks = {layer: threading.RLock() for layer in LAYERS}
+    if data_dir is None:
+      return
+
     logging.info('Loading cedict data...')
     self.load_cedict(os.path.join(data_dir, CEDICT_FILE))
     logging.info('Done')
-    
-    self.load_char_frequencies(os.path.join(data_dir, CHAR_FREQUENCY_FILE))
-    self.load_word_frequencies(os.path.join(data_dir, WORD_FREQUENCY_FILE))
-    self.load_hsk_chars(os.path.join(data_dir, HSK_CHARS_FILE))
-    self.load_hsk_words(os.path.join(data_dir, HSK_WORDS_FILE))
+
+    self._pending_layers = {
+      CHAR_FREQUENCY_LAYER: lambda: self.load_char_frequencies(
+        os.path.join(data_dir, CHAR_FREQUENCY_FILE)),
+      WORD_FREQUENCY_LAYER: lambda: self._load_word_layer(
+        os.path.join(data_dir, WORD_FREQUENCY_FILE)),
+      HSK_CHARS_LAYER: lambda: self.load_hsk_chars(
+        os.path.join(data_dir, HSK_CHARS_FILE)),
+      HSK_WORDS_LAYER: lambda: self.load_hsk_words(
+        os.path.join(data_dir, HSK_WORDS_FILE)),
+    }
+    self._load_layers(defer)
+
+  def _load_word_layer(self, frequency_file):
+    self.load_word_frequencies(frequency_file)
+    self.build_word_index()
+
+  def _load_layer(self, layer):
+    # A layer stays pending until its loader is done, so other threads wait
+    # for it. The loader itself reads the attributes of its own layer, which
+    # must not load it again.
+    if layer not in self._pending_layers:
+      return
+    with self._layer_locks[layer]:
+      if layer not in self._pending_layers or layer in self._loading_layers:
+        return
+      self._loading_layers.add(layer)
+      try:
+        self._pending_layers[layer]()
+      finally:
+        self._loading_layers.discard(layer)
+      del self._pending_layers[layer]
+
+  def _load_layers(self, defer):
+    # Layers are loaded one after the other, as they are pure Python and
+    # loading them from threads was no faster.
+    for layer in LAYERS:
+      if layer not in defer:
+        self._load_layer(layer)
+
+  def load_deferred(self):
+    """Loads all layers that were deferred, see __init__."""
+    for layer in LAYERS:
+      self._load_layer(layer)
+
+  @property
+  def chars_by_frequency(self):
+    self._load_layer(CHAR_FREQUENCY_LAYER)
+    return self._chars_by_frequency
+
+  @property
+  def word_index(self):
+    self._load_layer(WORD_FREQUENCY_LAYER)
+    return self._word_index
+
+  @property
+  def hsk_chars(self):
+    self._load_layer(HSK_CHARS_LAYER)
+    return self._hsk_chars
+
+  @property
+  def hsk_words(self):
+    self._load_layer(HSK_WORDS_LAYER)
+    return self._hsk_words
+
+  @staticmethod
+  def _source_paths(data_dir):
+    return [os.path.join(data_dir, f) for f in SOURCE_FILES]
+
+  @classmethod
+  def from_snapshot(cls, data_dir, snapshot_path=None, verify_hash=False,
+                    defer=()):
+    """Loads a Dict from its binary snapshot, rebuilding it if needed.
+
+    The snapshot is rebuilt from the source files in `data_dir` if it does not
+    exist, is truncated, was written by a different snapshot version, or any
+    source file has changed since it was built. Entries are made from the
+    mapped snapshot as they are looked up, see _SnapshotColumns.
+
+    Args:
+      data_dir: Directory with the dictionary source files.
+      snapshot_path: Path of the snapshot, defaults to SNAPSHOT_FILE in
+        `data_dir`.
+      verify_hash: If True, also compare source file hashes rather than just
+        sizes and modification times.
+      defer: Layers to only read from the snapshot on first access of the
+        attribute they fill, like in __init__. Entry fields are part of the
+        entry columns, so they are set either way. Ignored if the snapshot is
+        rebuilt.
+    """
+    if snapshot_path is None:
+      snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    payload = snapshot.load(snapshot_path, SNAPSHOT_KIND, SNAPSHOT_VERSION,
+                            cls._source_paths(data_dir),
+                            verify_hash=verify_hash)
+    if payload is None:
+      logging.info('Rebuilding dictionary snapshot {}'.format(snapshot_path))
+      d = cls(data_dir)
+      d.build_snapshot(snapshot_path)
+      return d
+    d = cls()
+    d.data_dir = data_dir
+    d._load_snapshot_payload(payload)
+    d._load_layers(defer)
+    return d
+
+  @property
+  def english_index(self):
+    if self._english_index is None:
+      # The ranking uses word frequencies and HSK levels.
+      self.load_deferred()
+      if self.data_dir is None:
+        self._english_index = EnglishIndex.build(self.entries)
+      else:
+        self._english_index = EnglishIndex.from_snapshot(
+          self.entries, os.path.join(self.data_dir, ENGLISH_INDEX_FILE),
+          self._source_paths(self.data_dir))
+    return self._english_index
+
+  def search_english(self, query, limit=20):
+    """Returns words with meanings matching the English `query`, best first."""
+    return self.english_index.search(query, limit)
+
+  def build_snapshot(self, snapshot_path=None):
+    """Writes a binary snapshot of this dictionary, see from_snapshot()."""
+    if snapshot_path is None:
+      snapshot_path = os.path.join(self.data_dir, SNAPSHOT_FILE)
+    self.load_deferred()
+
+    # Entries are stored column-wise, with meanings flattened into two lists
+    # and `meaning_counts` giving the number of meanings of each entry.
+    entries = list(self.entries.values())
+    meaning_counts = array('I')
+    pinyins = []
+    meanings = []
+    for entry in entries:
+      meaning_counts.append(entry._stop - entry._start)
+      pinyins.extend(entry._table.pinyins[entry._start:entry._stop])
+      meanings.extend(entry._table.meanings[entry._start:entry._stop])
+
+    payload = {
+      'words': [e.word for e in entries],
+      'traditional': ['' if e.traditional == e.word else e.traditional
+                      for e in entries],
+      'meaning_counts': meaning_counts.tobytes(),
+      'pinyins': pinyins,
+      'meanings': meanings,
+      'char_frequency': array('d', [e.char_frequency for e in entries]).tobytes(),
+      'word_frequency': array('d', [e.word_frequency for e in entries]).tobytes(),
+      'char_hsk_level': bytes(e.char_hsk_level for e in entries),
+      'word_hsk_level': bytes(e.word_hsk_level for e in entries),
+      'chars_by_frequency': self.chars_by_frequency,
+      'hsk_chars': self.hsk_chars,
+      'hsk_words': self.hsk_words,
+      'word_index': self.word_index.to_payload(),
+    }
+    snapshot.write(snapshot_path, SNAPSHOT_KIND, SNAPSHOT_VERSION,
+                   self._source_paths(self.data_dir), payload)
+
+  def _load_snapshot_payload(self, payload):
+    columns = _SnapshotColumns(payload, self.meaning_table)
+    self.entries = _SnapshotEntryView(columns, 'word')
+    self.traditional_to_entry = _SnapshotEntryView(columns, 'traditional')
+    self._pending_layers = {
+      CHAR_FREQUENCY_LAYER: lambda: setattr(
+        self, '_chars_by_frequency', payload['chars_by_frequency']),
+      WORD_FREQUENCY_LAYER: lambda: setattr(
+        self, '_word_index', SubstringIndex.from_payload(payload['word_index'])),
+      HSK_CHARS_LAYER: lambda: setattr(
+        self, '_hsk_chars', payload['hsk_chars']),
+      HSK_WORDS_LAYER: lambda: setattr(
+        self, '_hsk_words', payload['hsk_words']),
+    }
 
   def load_cedict(self, cedict_file):
+    # Meanings are collected per word, and then packed in to `meaning_table`
+    # in entry order once all lines are read.
+    word_meanings = {}
+
     # Read all data from the data file.
-    for line in open(cedict_file, 'r').readlines():
-      if line[0] == '#':
-        continue
-      m = re.match(r"(\S*)\s(\S*)\s\[(.*)\] /(.*)/", line)
-      assert m
-      trad = m.group(1)
-      word = m.group(2)
-      pinyin = m.group(3)
-      meaning = m.group(4)
-      if not word in self.entries:
-        self.entries[word] = DictEntry(word, trad)
-        self.traditional_to_entry[trad] = self.entries[word]
-      self.entries[word].meanings.append(MeaningEntry(pinyin, meaning))
- 
+    with open(cedict_file, 'r') as f:
+      for line in f:
+        if line[0] == '#':
+          continue
+        m = re.match(r"(\S*)\s(\S*)\s\[(.*)\] /(.*)/", line)
+        assert m
+        trad = m.group(1)
+        word = m.group(2)
+        pinyin = m.group(3)
+        meaning = m.group(4)
+        if not word in self.entries:
+          entry = DictEntry(word, trad)
+          self.entries[word] = entry
+          self.traditional_to_entry[entry.traditional] = entry
+          word_meanings[word] = []
+        word_meanings[word].append((pinyin, meaning))
+
     # Re-sort meaning entries so the "main" meaning comes first. We prioritize
     # definitions that are not a "variant".
-    for _, entry in self.entries.items():
-      entry.meanings.sort(key=_meaning_importance)
+    for word, entry in self.entries.items():
+      meanings = word_meanings[word]
+      meanings.sort(key=lambda m: _meaning_importance(m[1]))
+      entry._set_meaning_range(self.meaning_table, *self.meaning_table.extend(
+        [m[0] for m in meanings], [m[1] for m in meanings]))
 
   def load_char_frequencies(self, frequency_file):
     last_cdf = 0.0
     num_not_found = 0
     num_traditional = 0
     probability_mass_not_found = 0.0
-    for line in open(frequency_file).readlines():
-      c = line.split()[1]
-      cdf = float(line.split()[3]) / 100.0
-      frequency = cdf - last_cdf
-      last_cdf = cdf
-
-      if not c in self.entries:
-        if c in self.traditional_to_entry:
-          num_traditional += 1
+    with open(frequency_file) as f:
+      for line in f:
+        c = line.split()[1]
+        cdf = float(line.split()[3]) / 100.0
+        frequency = cdf - last_cdf
+        last_cdf = cdf
+
+        if not c in self.entries:
+          if c in self.traditional_to_entry:
+            num_traditional += 1
+          else:
+            num_not_found += 1
+            probability_mass_not_found += frequency
         else:
-          num_not_found += 1
-          probability_mass_not_found += frequency
-      else:
-        self.chars_by_frequency.append(c)
-        self.entries[c].char_frequency = frequency
+          self.chars_by_frequency.append(c)
+          self.entries[c].char_frequency = frequency
 
     if num_not_found:
       logging.info('{} characters in frequency table, but not found in CC-CEDICT.'.format(num_not_found))
@@ -220,29 +778,24 @@ class Dict:
       logging.info('Total traditional characters ignored for frequency: {}'.format(num_traditional))
 
   def load_word_frequencies(self, frequency_file):
-    l = 0
     num_not_found = 0
     probability_mass_not_found = 0.0
 
-    for line in open(frequency_file).readlines():
-      if l == 0:
-        word_count = int(line.split(':')[1].split('"')[0].replace(',',''))
-      elif l > 2:
-        line = line.split(',')
-        word = line[0].strip()
-        frequency = float(line[1]) / word_count
+    with open(frequency_file) as f:
+      for l, line in enumerate(f):
+        if l == 0:
+          word_count = int(line.split(':')[1].split('"')[0].replace(',',''))
+        elif l > 2:
+          line = line.split(',')
+          word = line[0].strip()
+          frequency = float(line[1]) / word_count
         
-        if not word in self.entries:
-          num_not_found += 1
-          probability_mass_not_found += frequency
-        else:
-          self.entries[word].word_frequency = frequency
-
-        for char in set(word):
-          if char not in self.char_to_words:
-            self.char_to_words[char] = []
-          self.char_to_words[char].append((word, l-1))
-      l += 1
+          if not word in self.entries:
+            num_not_found += 1
+            probability_mass_not_found += frequency
+          else:
+            self.entries[word].word_frequency = frequency
+          self._frequency_words.append((word, l-1))
 
     if num_not_found:
       logging.info(
@@ -250,30 +803,44 @@ class Dict:
           num_not_found))
       logging.info('Total mass not found: {}'.format(probability_mass_not_found))
 
+  def build_word_index(self):
+    """Builds `word_index` from the loaded word frequencies and entries."""
+    words = [w for w, _ in self._frequency_words]
+    ranks = array('I', [r for _, r in self._frequency_words])
+    ranked = set(words)
+    for word in self.entries:
+      if word not in ranked:
+        words.append(word)
+        ranks.append(0)
+    self._word_index = SubstringIndex(words, ranks)
+    self._frequency_words = []
+
   def load_hsk_chars(self, hsk_chars_file):
-    for line in open(hsk_chars_file).readlines():
-      chars = [c for c in line.strip().split(u'，')]
-      if len(chars):
-        self.hsk_chars.append(chars)
-        for c in chars:
-          self.entries[c].char_hsk_level = len(self.hsk_chars)
+    with open(hsk_chars_file) as f:
+      for line in f:
+        chars = [c for c in line.strip().split(u'，')]
+        if len(chars):
+          self.hsk_chars.append(chars)
+          for c in chars:
+            self.entries[c].char_hsk_level = len(self.hsk_chars)
 
   def load_hsk_words(self, hsk_words_file):
     level_words = []
     num_words_without_entries = 0
 
-    for line in open(hsk_words_file).readlines():
-      if line[0] == '#':
-        if level_words:
-          self.hsk_words.append(level_words)
-        level_words = []
-        continue
-      word = line.strip()
-      if word in self.entries:
-        self.entries[word].word_hsk_level = len(self.hsk_words) + 1
-      else:
-        num_words_without_entries += 1
-      level_words.append(word)
+    with open(hsk_words_file) as f:
+      for line in f:
+        if line[0] == '#':
+          if level_words:
+            self.hsk_words.append(level_words)
+          level_words = []
+          continue
+        word = line.strip()
+        if word in self.entries:
+          self.entries[word].word_hsk_level = len(self.hsk_words) + 1
+        else:
+          num_words_without_entries += 1
+        level_words.append(word)
     if level_words:
       self.hsk_words.append(level_words)
 
@@ -284,7 +851,7 @@ class Dict:
 
 if __name__ == "__main__":
   logging.basicConfig(level=logging.INFO)
-  import config
-  d = Dict(config.get_data_dir())
+  from common import config
+  d = Dict.from_snapshot(config.get_data_dir())
   print(d.entries[u'差'])
-  print(d.char_to_words[u'差'])
+  print(d.word_index.search(u'差', limit=20))
@@ -21,6 +21,18 @@ def get_anki_collection():
 def get_example_db_path():
   return os.path.join(get_data_dir(), 'examples.db')
 
+def get_dict_db_path():
+  return os.path.join(get_data_dir(), 'cdict.db')
+
+def get_anki_known_cache_path():
+  return os.path.join(get_data_dir(), 'anki_known.cache')
+
+def get_anki_note_search_path():
+  return os.path.join(get_data_dir(), 'anki_notes.db')
+
+def get_scrape_cache_dir():
+  return os.path.join(get_data_dir(), 'scrape_cache')
+
 def get_pending_anki_csv():
   return get_config()['pending_anki_csv']
 
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Full-text index over the English meanings of dictionary entries.
+
+Entries are ranked with BM25 over the words of all their meanings, boosted
+by word frequency and HSK level. Since the score of an entry is a sum of
+per-term contributions, each contribution is computed when the index is
+built, and postings are stored as arrays sorted by contribution. A query
+then only reads the head of each posting list.
+
+The index is persisted as a snapshot (see common.snapshot) next to the
+dictionary snapshot, and postings are only decoded when a term is queried.
+"""
+
+from array import array
+import heapq
+import logging
+import math
+import re
+
+from common import snapshot
+
+SNAPSHOT_KIND = 'english_index'
+SNAPSHOT_VERSION = 1
+
+DEFAULT_LIMIT = 20
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+# Number of postings read per query term. Postings are sorted by their
+# contribution to the score, so this only drops the weakest matches of very
+# common terms such as "to" or "of".
+MAX_POSTINGS_PER_TERM = 1000
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def tokenize(text):
+  """Returns the lower case words of English text."""
+  return _TOKEN.findall(text.lower())
+
+
+def _boost(entry):
+  """Returns the score multiplier of an entry.
+
+  Frequent words get up to about twice the score of rare ones, HSK words up
+  to another 50%, more for lower levels.
+  """
+  boost = 1.0 + 0.2 * math.log10(1.0 + entry.word_frequency * 1e6)
+  hsk_level = entry.word_hsk_level or entry.char_hsk_level
+  if hsk_level:
+    boost += 0.5 * (7 - hsk_level) / 6
+  return boost
+
+
+class EnglishIndex:
+  """Inverted index from English words to dictionary words.
+
+  Attributes:
+    words: The indexed dictionary words, postings refer to them by position.
+    postings: Map from a term to a pair of bytes, the packed array('I') of
+      word positions and the packed array('f') of their score contributions,
+      both sorted by decreasing contribution.
+  """
+
+  def __init__(self, words, postings):
+    self.words = words
+    self.postings = postings
+
+  @classmethod
+  def build(cls, entries):
+    """Builds the index from a map of word to DictEntry."""
+    words = []
+    doc_terms = []
+    boosts = []
+    for word, entry in entries.items():
+      counts = {}
+      for meaning in entry.meanings:
+        for term in tokenize(meaning.meaning):
+          counts[term] = counts.get(term, 0) + 1
+      if not counts:
+        continue
+      words.append(word)
+      doc_terms.append(counts)
+      boosts.append(_boost(entry))
+
+    doc_lens = [sum(counts.values()) for counts in doc_terms]
+    avg_len = sum(doc_lens) / max(len(doc_lens), 1)
+    term_docs = {}
+    for doc, counts in enumerate(doc_terms):
+      for term, tf in counts.items():
+        term_docs.setdefault(term, []).append((doc, tf))
+
+    n = len(words)
+    postings = {}
+    for term, docs in term_docs.items():
+      idf = math.log(1.0 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+      weighted = []
+      for doc, tf in docs:
+        norm = K1 * (1.0 - B + B * doc_lens[doc] / avg_len)
+        weighted.append(
+          (idf * tf * (K1 + 1.0) / (tf + norm) * boosts[doc], doc))
+      weighted.sort(reverse=True)
+      postings[term] = (array('I', [d for _, d in weighted]).tobytes(),
+                        array('f', [w for w, _ in weighted]).tobytes())
+    return cls(words, postings)
+
+  @classmethod
+  def from_snapshot(cls, entries, snapshot_path, source_paths):
+    """Loads the index from its snapshot, rebuilding it if needed.
+
+    Args:
+      entries: Map of word to DictEntry, only read if the index is rebuilt.
+      snapshot_path: Path of the index snapshot.
+      source_paths: Files the dictionary was built from, see snapshot.load().
+    """
+    payload = snapshot.load(snapshot_path, SNAPSHOT_KIND, SNAPSHOT_VERSION,
+                            source_paths)
+    if payload is not None:
+      return cls(payload['words'], payload['postings'])
+    logging.info('Rebuilding english index snapshot {}'.format(snapshot_path))
+    index = cls.build(entries)
+    snapshot.write(snapshot_path, SNAPSHOT_KIND, SNAPSHOT_VERSION,
+                   source_paths,
+                   {'words': index.words, 'postings': index.postings})
+    return index
+
+  def search(self, query, limit=DEFAULT_LIMIT):
+    """Returns up to `limit` words whose meanings best match `query`."""
+    scores = {}
+    for term in set(tokenize(query)):
+      posting = self.postings.get(term)
+      if posting is None:
+        continue
+      docs = array('I')
+      docs.frombytes(posting[0][:docs.itemsize * MAX_POSTINGS_PER_TERM])
+      weights = array('f')
+      weights.frombytes(posting[1][:weights.itemsize * MAX_POSTINGS_PER_TERM])
+      for doc, weight in zip(docs, weights):
+        scores[doc] = scores.get(doc, 0.0) + weight
+    best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+    return [self.words[doc] for doc, _ in best]
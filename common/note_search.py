@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Side database mirroring anki note fields, for indexed lookups.
+
+The notes of some decks of a collection are copied to a separate sqlite
+database, with one row per note field. Exact field lookups use a b-tree
+index on the field values, and substring lookups an FTS5 trigram index.
+
+The mirror is brought up to date whenever the collection's mod or usn
+changed: only notes modified since the last sync are copied again, and
+notes which left the decks are dropped.
+"""
+
+import sqlite3
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+  CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+  CREATE TABLE IF NOT EXISTS notes (nid INTEGER PRIMARY KEY, flds TEXT);
+  CREATE TABLE IF NOT EXISTS note_decks (
+    did INTEGER, nid INTEGER, PRIMARY KEY (did, nid)) WITHOUT ROWID;
+  CREATE INDEX IF NOT EXISTS ix_note_decks_nid ON note_decks (nid);
+  CREATE TABLE IF NOT EXISTS fields (
+    id INTEGER PRIMARY KEY, nid INTEGER, pos INTEGER, value TEXT);
+  CREATE INDEX IF NOT EXISTS ix_fields_pos ON fields (pos, value, nid);
+  CREATE INDEX IF NOT EXISTS ix_fields_nid ON fields (nid);
+  CREATE VIRTUAL TABLE IF NOT EXISTS fields_fts USING fts5(
+    value, content='fields', content_rowid='id', tokenize='trigram');
+"""
+
+# The trigram tokenizer can only use its index for substrings of at least
+# this many characters.
+_MIN_FTS_LENGTH = 3
+
+# Number of note ids per query when fetching notes by id.
+_FETCH_BATCH = 500
+
+
+def _placeholders(values):
+  return ','.join('?' * len(values))
+
+
+def _batches(values):
+  for i in range(0, len(values), _FETCH_BATCH):
+    yield values[i:i + _FETCH_BATCH]
+
+
+class NoteSearch:
+  """Indexed lookups of the notes in some decks of an anki collection."""
+
+  def __init__(self, db_path, collection, deck_ids):
+    """Opens or creates the side database, and syncs it.
+
+    Args:
+      db_path: Path of the side database.
+      collection: sqlite connection to the anki collection.
+      deck_ids: Ids of the decks to mirror.
+    """
+    self.collection = collection
+    self.deck_ids = sorted(deck_ids)
+    # Like AnkiReader, may be shared between threads one at a time. Syncs
+    # are explicit transactions, so other processes see them whole.
+    self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None,
+                                check_same_thread=False)
+    self.conn.executescript(_SCHEMA)
+    self._col_state = None
+    self.sync()
+
+  def _get_meta(self, key):
+    row = self.conn.execute(
+      'SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+    return None if row is None else row[0]
+
+  def _set_meta(self, key, value):
+    self.conn.execute(
+      'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+  def _stored_state(self):
+    return (self._get_meta('version'), self._get_meta('deck_ids'),
+            self._get_meta('col'))
+
+  def sync(self):
+    """Brings the mirror up to date with the collection, if it changed."""
+    mod, usn = self.collection.execute('SELECT mod, usn FROM col').fetchone()
+    col_state = '{} {}'.format(mod, usn)
+    if col_state == self._col_state:
+      return
+    state = (SCHEMA_VERSION, ','.join(map(str, self.deck_ids)), col_state)
+    if self._stored_state() == state:
+      self._col_state = col_state
+      return
+
+    self.conn.execute('BEGIN IMMEDIATE')
+    try:
+      # Another process may have synced while we waited for the lock.
+      stored_state = self._stored_state()
+      if stored_state != state:
+        if stored_state[:2] != state[:2]:
+          for table in ('notes', 'note_decks', 'fields', 'meta'):
+            self.conn.execute('DELETE FROM {}'.format(table))
+        self._sync_notes()
+        self._set_meta('version', state[0])
+        self._set_meta('deck_ids', state[1])
+        self._set_meta('col', state[2])
+      self.conn.execute('COMMIT')
+    except BaseException:
+      self.conn.execute('ROLLBACK')
+      raise
+    self._col_state = col_state
+
+  def _sync_notes(self):
+    deck_notes = set(self.collection.execute(
+      'SELECT DISTINCT did, nid FROM cards WHERE did IN ({})'.format(
+        _placeholders(self.deck_ids)), self.deck_ids))
+    stored_deck_notes = set(self.conn.execute(
+      'SELECT did, nid FROM note_decks'))
+    self.conn.executemany(
+      'DELETE FROM note_decks WHERE did=? AND nid=?',
+      stored_deck_notes - deck_notes)
+    self.conn.executemany(
+      'INSERT INTO note_decks (did, nid) VALUES (?, ?)',
+      deck_notes - stored_deck_notes)
+
+    nids = {nid for _, nid in deck_notes}
+    stored_nids = set(
+      nid for nid, in self.conn.execute('SELECT nid FROM notes'))
+
+    # Notes changed in the same second as the last sync have the same mod,
+    # so they are copied again.
+    note_mod = self._get_meta('note_mod') or 0
+    changed = {}
+    for nid, flds, mod in self.collection.execute(
+        'SELECT id, flds, mod FROM notes WHERE mod>=?', (note_mod,)):
+      note_mod = max(note_mod, mod)
+      if nid in nids:
+        changed[nid] = flds
+    missing = list(nids - stored_nids - set(changed))
+    for batch in _batches(missing):
+      changed.update(self.collection.execute(
+        'SELECT id, flds FROM notes WHERE id IN ({})'.format(
+          _placeholders(batch)), batch))
+
+    self._delete_notes(list((stored_nids - nids) |
+                            (stored_nids & set(changed))))
+    self._insert_notes(changed)
+    self._set_meta('note_mod', note_mod)
+
+  def _delete_notes(self, nids):
+    for batch in _batches(nids):
+      in_batch = 'IN ({})'.format(_placeholders(batch))
+      # The full text index has no copy of the values, so it is told which
+      # ones to remove.
+      self.conn.executemany(
+        "INSERT INTO fields_fts (fields_fts, rowid, value) "
+        "VALUES ('delete', ?, ?)",
+        list(self.conn.execute(
+          'SELECT id, value FROM fields WHERE nid ' + in_batch, batch)))
+      self.conn.execute('DELETE FROM fields WHERE nid ' + in_batch, batch)
+      self.conn.execute('DELETE FROM notes WHERE nid ' + in_batch, batch)
+
+  def _insert_notes(self, notes):
+    """Inserts notes given as a map from note id to fields."""
+    self.conn.executemany(
+      'INSERT INTO notes (nid, flds) VALUES (?, ?)', notes.items())
+    next_id = self.conn.execute(
+      'SELECT COALESCE(MAX(id), 0) + 1 FROM fields').fetchone()[0]
+    fields = []
+    for nid, flds in notes.items():
+      for pos, value in enumerate(flds.split(u'\u001f')):
+        fields.append((next_id, nid, pos, value))
+        next_id += 1
+    self.conn.executemany(
+      'INSERT INTO fields (id, nid, pos, value) VALUES (?, ?, ?, ?)', fields)
+    self.conn.executemany(
+      'INSERT INTO fields_fts (rowid, value) VALUES (?, ?)',
+      [(field[0], field[3]) for field in fields])
+
+  def find(self, deck_id, pos, value):
+    """Returns the notes in a deck whose field `pos` is exactly `value`.
+
+    Notes are returned as lists of fields, in order of note id.
+    """
+    self.sync()
+    return [flds.split(u'\u001f') for flds, in self.conn.execute(
+      'SELECT notes.flds FROM fields '
+      'JOIN note_decks ON note_decks.nid=fields.nid '
+      'JOIN notes ON notes.nid=fields.nid '
+      'WHERE fields.value=? AND fields.pos=? AND note_decks.did=? '
+      'ORDER BY fields.nid', (value, pos, deck_id))]
+
+  def search(self, deck_ids, substring, pos=None, limit=None):
+    """Returns notes with a field containing `substring`.
+
+    Args:
+      deck_ids: Ids of the decks to search.
+      substring: The substring to look for.
+      pos: If set, only look in this field.
+      limit: If set, the maximum number of notes to return.
+
+    Returns:
+      A list of tuples (deck id, note as a list of fields), in order of
+      note id.
+    """
+    self.sync()
+    if not substring:
+      return []
+    if len(substring) >= _MIN_FTS_LENGTH:
+      # The CROSS JOINs make sqlite start from the matches of the index.
+      query = (
+        'SELECT DISTINCT note_decks.did, notes.nid, notes.flds '
+        'FROM fields_fts CROSS JOIN fields ON fields.id=fields_fts.rowid ')
+      conditions = ['fields_fts MATCH ?']
+      args = ['"{}"'.format(substring.replace('"', '""'))]
+    else:
+      # Too short for the trigram index, so scan the field values, which
+      # ix_fields_pos covers.
+      query = (
+        'SELECT DISTINCT note_decks.did, notes.nid, notes.flds FROM fields ')
+      conditions = ['instr(fields.value, ?) > 0']
+      args = [substring]
+    query += ('CROSS JOIN note_decks ON note_decks.nid=fields.nid '
+              'JOIN notes ON notes.nid=fields.nid ')
+    conditions.append('note_decks.did IN ({})'.format(
+      _placeholders(deck_ids)))
+    args.extend(deck_ids)
+    if pos is not None:
+      conditions.append('fields.pos=?')
+      args.append(pos)
+    query += 'WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY notes.nid'
+    if limit is not None:
+      query += ' LIMIT ?'
+      args.append(limit)
+    return [(did, flds.split(u'\u001f'))
+            for did, _, flds in self.conn.execute(query, args)]
+
+  def duplicates(self, deck_id, pos):
+    """Returns a map from each value of field `pos` shared by several notes
+    in a deck to the ids of those notes."""
+    self.sync()
+    result = {}
+    for value, nids in self.conn.execute(
+        'SELECT fields.value, GROUP_CONCAT(fields.nid) FROM fields '
+        'JOIN note_decks ON note_decks.nid=fields.nid '
+        "WHERE note_decks.did=? AND fields.pos=? AND fields.value != '' "
+        'GROUP BY fields.value HAVING COUNT(*) > 1', (deck_id, pos)):
+      result[value] = sorted(int(nid) for nid in nids.split(','))
+    return result
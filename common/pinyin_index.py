@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Index for looking up words by their pinyin.
+
+Every reading of every entry is indexed by its pinyin with spaces removed,
+both with tone numbers ("jia1ju4") and without ("jiaju"), so a query can be
+either and only needs to be a prefix. The umlaut is written as 'v'.
+"""
+
+import bisect
+import heapq
+import unicodedata
+
+DEFAULT_LIMIT = 20
+
+# Prefixes matching more keys than this have their top words precomputed, so
+# short queries like "j" do not merge thousands of word lists.
+_MAX_MERGED_KEYS = 32
+# Number of words precomputed per prefix. Larger limits fall back to merging.
+_PRECOMPUTED_WORDS = 50
+
+# Combining diaeresis, left over from 'ü' after unicode decomposition.
+_DIAERESIS = u'\u0308'
+
+
+def normalize(pinyin):
+  """Returns pinyin in the form used by the index.
+
+  Accepts tone numbers, tone diacritics (which are dropped), 'u:', 'ü' or 'v'
+  for the umlaut, and any spacing or apostrophes.
+  """
+  pinyin = unicodedata.normalize('NFD', pinyin.lower())
+  pinyin = pinyin.replace(u'u' + _DIAERESIS, 'v').replace('u:', 'v')
+  return ''.join(c for c in pinyin
+                 if c.isalnum() and not unicodedata.combining(c))
+
+
+def _toneless(pinyin):
+  return ''.join(c for c in pinyin if not c.isdigit())
+
+
+class PinyinIndex:
+  """Inverted index from normalized pinyin to words.
+
+  Keys are kept in a sorted list, so all keys with a given prefix are a
+  contiguous range found by bisection. The words of each key are sorted by
+  frequency, and a search merges the heads of the lists in the range until
+  it has enough words. Prefixes with a large range have their top words
+  precomputed instead.
+  """
+
+  def __init__(self, entries):
+    """Builds the index.
+
+    Args:
+      entries: A map from word to DictEntry, e.g. cdict.Dict.entries.
+    """
+    key_words = {}
+    self._frequencies = {}
+    for word, entry in entries.items():
+      self._frequencies[word] = entry.word_frequency
+      for meaning in entry.meanings:
+        toned = normalize(meaning.pinyin)
+        for key in (toned, _toneless(toned)):
+          words = key_words.setdefault(key, [])
+          if not words or words[-1] != word:
+            words.append(word)
+    self._keys = sorted(key_words)
+    self._words = [sorted(key_words[k], key=self._frequencies.__getitem__,
+                          reverse=True)
+                   for k in self._keys]
+
+    # Map from a prefix matching more than _MAX_MERGED_KEYS keys to its top
+    # _PRECOMPUTED_WORDS words.
+    self._top_words = {}
+    self._precompute(0, len(self._keys), 0)
+
+  def _precompute(self, lo, hi, depth):
+    """Fills `_top_words` for the prefixes longer than `depth` of the keys in
+    [lo, hi), which share their first `depth` characters.
+
+    Returns word lists whose merge gives the top words of the shared prefix.
+    The top words of a longer prefix stand in for its keys, as a word among
+    the top words of a prefix is also among the top words of the longer
+    prefix it comes from.
+    """
+    lists = []
+    i = lo
+    while i < hi:
+      key = self._keys[i]
+      if len(key) == depth:
+        lists.append(self._words[i])
+        i += 1
+        continue
+      prefix = key[:depth + 1]
+      j = bisect.bisect_left(self._keys, prefix + u'\uffff', i, hi)
+      if j - i > _MAX_MERGED_KEYS:
+        top = self._merge(self._precompute(i, j, depth + 1),
+                          _PRECOMPUTED_WORDS)
+        self._top_words[prefix] = top
+        lists.append(top)
+      else:
+        lists.extend(self._words[i:j])
+      i = j
+    return lists
+
+  def _merge(self, lists, limit):
+    """Returns the `limit` most frequent words of lists of words sorted by
+    frequency."""
+    frequencies = self._frequencies
+    heap = [(-frequencies[words[0]], i, 0) for i, words in enumerate(lists)]
+    heapq.heapify(heap)
+    result = []
+    seen = set()
+    while heap and len(result) < limit:
+      _, i, j = heap[0]
+      word = lists[i][j]
+      if word not in seen:
+        seen.add(word)
+        result.append(word)
+      j += 1
+      if j < len(lists[i]):
+        heapq.heapreplace(heap, (-frequencies[lists[i][j]], i, j))
+      else:
+        heapq.heappop(heap)
+    return result
+
+  def search(self, query, limit=DEFAULT_LIMIT):
+    """Returns up to `limit` words with a reading starting with `query`.
+
+    Words are ranked by word frequency, most frequent first.
+    """
+    query = normalize(query)
+    if not query:
+      return []
+    words = self._top_words.get(query)
+    # A list shorter than _PRECOMPUTED_WORDS has all words of the prefix.
+    if words is not None and (limit <= len(words) or
+                              len(words) < _PRECOMPUTED_WORDS):
+      return words[:limit]
+    lo = bisect.bisect_left(self._keys, query)
+    hi = bisect.bisect_left(self._keys, query + u'\uffff', lo)
+    return self._merge(self._words[lo:hi], limit)
+
+
+if __name__ == "__main__":
+  import sys
+  from common import cdict
+  from common import config
+  index = PinyinIndex(cdict.Dict.from_snapshot(config.get_data_dir()).entries)
+  for query in sys.argv[1:]:
+    print(query, index.search(query))
@@ -0,0 +1,71 @@
+"""Process-wide pool of reusable objects, such as database readers.
+
+Objects are created on demand up to a maximum size, and handed to one
+thread at a time. Objects holding sqlite connections must therefore open
+them with check_same_thread=False.
+
+A pool inherited by a forked worker process drops the parent's objects
+rather than sharing their connections.
+"""
+
+import contextlib
+import os
+import queue
+import threading
+
+DEFAULT_MAX_SIZE = 8
+
+
+class Pool:
+  """A thread-safe pool of objects made by a factory function."""
+
+  def __init__(self, factory, max_size=DEFAULT_MAX_SIZE):
+    self._factory = factory
+    self._max_size = max_size
+    self._lock = threading.Lock()
+    self._reset()
+
+  def _reset(self):
+    self._pid = os.getpid()
+    self._idle = queue.LifoQueue()
+    self._size = 0
+
+  def acquire(self):
+    """Returns an idle object, making a new one if the pool is not full.
+
+    Blocks until an object is released if the pool is full.
+    """
+    with self._lock:
+      if self._pid != os.getpid():
+        self._reset()
+      try:
+        return self._idle.get_nowait()
+      except queue.Empty:
+        pass
+      if self._size < self._max_size:
+        self._size += 1
+        create = True
+      else:
+        create = False
+    if not create:
+      return self._idle.get()
+    try:
+      return self._factory()
+    except Exception:
+      with self._lock:
+        self._size -= 1
+      raise
+
+  def release(self, obj):
+    """Returns an object acquired from this pool."""
+    if self._pid == os.getpid():
+      self._idle.put(obj)
+
+  @contextlib.contextmanager
+  def get(self):
+    """Context manager acquiring and releasing an object."""
+    obj = self.acquire()
+    try:
+      yield obj
+    finally:
+      self.release(obj)
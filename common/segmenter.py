@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Splits Chinese text into dictionary words.
+
+Segmentation is maximal matching over the words of a dictionary: each run of
+chinese characters is split into the fewest dictionary words, with ties broken
+in favour of the more frequent words. Characters that are not part of any
+dictionary word become single character words, and text between runs of
+chinese characters (punctuation, latin text, whitespace) is passed through as
+is.
+"""
+
+import math
+import sys
+
+from common import util
+
+# Frequency given to words and characters without a known word frequency.
+MIN_FREQUENCY = 1e-9
+
+# Text held back by iter_segments() while waiting for the end of a run of
+# chinese characters, before it is segmented anyway.
+MAX_PENDING = 1 << 16
+
+
+class Segmenter:
+  """Maximal matching word segmenter, built once from a dictionary.
+
+  The words are kept in a hashed trie: a map from every prefix of every word
+  to the cost of that prefix as a word, or None if the prefix is not itself a
+  word. Matching all words starting at a position is then a walk that stops
+  at the first missing prefix.
+  """
+
+  def __init__(self, entries):
+    """Builds the segmenter.
+
+    Args:
+      entries: A map from word to DictEntry, e.g. cdict.Dict.entries.
+    """
+    self._prefixes = {}
+    self.max_word_len = 1
+    for word, entry in entries.items():
+      if not util.is_chinese(word):
+        continue
+      for i in range(1, len(word)):
+        self._prefixes.setdefault(word[:i], None)
+      self._prefixes[word] = -math.log(
+        max(entry.word_frequency, MIN_FREQUENCY))
+      self.max_word_len = max(self.max_word_len, len(word))
+
+  def _segment_run(self, run):
+    """Returns the words of a run of chinese characters."""
+    prefixes = self._prefixes
+    max_len = self.max_word_len
+    unknown_cost = -math.log(MIN_FREQUENCY)
+    n = len(run)
+    # counts[i] and costs[i] are the number of words and total cost of the
+    # best segmentation of run[i:], whose first word ends at ends[i].
+    counts = [0] * (n + 1)
+    costs = [0.0] * (n + 1)
+    ends = [0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+      cost = prefixes.get(run[i])
+      best_end = i + 1
+      best_count = counts[i + 1] + 1
+      best_cost = costs[i + 1] + (unknown_cost if cost is None else cost)
+      for j in range(i + 2, min(n, i + max_len) + 1):
+        word = run[i:j]
+        if word not in prefixes:
+          break
+        cost = prefixes[word]
+        if cost is None:
+          continue
+        count = counts[j] + 1
+        cost += costs[j]
+        if count < best_count or (count == best_count and cost < best_cost):
+          best_end = j
+          best_count = count
+          best_cost = cost
+      counts[i] = best_count
+      costs[i] = best_cost
+      ends[i] = best_end
+    words = []
+    i = 0
+    while i < n:
+      words.append(run[i:ends[i]])
+      i = ends[i]
+    return words
+
+  def _iter_text(self, text):
+    last = 0
+    for m in util.CHINESE_RUN.finditer(text):
+      if m.start() > last:
+        yield text[last:m.start()]
+      yield from self._segment_run(m.group())
+      last = m.end()
+    if last < len(text):
+      yield text[last:]
+
+  def segment(self, text):
+    """Returns text split into words, see the module docstring."""
+    return list(self._iter_text(text))
+
+  def iter_segments(self, chunks):
+    """Yields the words of text given as an iterable of chunks.
+
+    Chunks can be anything that splits the text, e.g. the lines of an open
+    file. A run of chinese characters at the end of a chunk is held back
+    until the run ends, so words are not broken at chunk boundaries.
+    """
+    pending = ''
+    for chunk in chunks:
+      text = pending + chunk
+      last_run = None
+      for last_run in util.CHINESE_RUN.finditer(text):
+        pass
+      if (last_run is not None and last_run.end() == len(text) and
+          len(text) < MAX_PENDING):
+        pending = text[last_run.start():]
+        text = text[:last_run.start()]
+      else:
+        pending = ''
+      yield from self._iter_text(text)
+    yield from self._iter_text(pending)
+
+
+if __name__ == "__main__":
+  from common import cdict
+  from common import config
+  segmenter = Segmenter(cdict.Dict.from_snapshot(config.get_data_dir()).entries)
+  for word in segmenter.iter_segments(sys.stdin):
+    sys.stdout.write(word if not util.is_chinese(word) else word + ' ')
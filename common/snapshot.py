@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Versioned binary images of data derived from source files.
+
+An image is a small header followed by a payload of named sections. The
+header records the payload kind and version, plus a fingerprint (size, mtime
+and sha1) of every source file the payload was derived from, so stale images
+are detected and rebuilt instead of silently served.
+
+Each section is marshalled separately, and the header records where it is.
+Loading an image only maps the file and reads the header; a section is
+unmarshalled from the mapping when it is first read, see Sections.
+
+Layout:
+  MAGIC | struct HEADER (version, header length) | JSON header | sections
+"""
+
+from collections.abc import Mapping
+import hashlib
+import json
+import logging
+import marshal
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b'CTSNP2'
+HEADER = struct.Struct('<6sHI')
+
+
+def _sha1(path):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def fingerprint(source_paths):
+  """Returns a JSON-serializable fingerprint of the given source files."""
+  result = []
+  for path in source_paths:
+    st = os.stat(path)
+    result.append([os.path.basename(path), st.st_size, st.st_mtime_ns,
+                   _sha1(path)])
+  return result
+
+
+def _is_fresh(stored, source_paths, verify_hash):
+  if len(stored) != len(source_paths):
+    return False
+  for (name, size, mtime_ns, sha1), path in zip(stored, source_paths):
+    if name != os.path.basename(path):
+      return False
+    try:
+      st = os.stat(path)
+    except FileNotFoundError:
+      return False
+    if st.st_size != size or st.st_mtime_ns != mtime_ns:
+      return False
+    if verify_hash and _sha1(path) != sha1:
+      return False
+  return True
+
+
+class Sections(Mapping):
+  """Read-only map from section name to its value, backed by a mapped image.
+
+  Sections are unmarshalled on first access and then kept. The mapping stays
+  open as long as this object is referenced; an image replaced on disk keeps
+  being read from the old file.
+  """
+
+  def __init__(self, mm, offset, sections):
+    self._mm = mm
+    self._offset = offset
+    self._sections = sections
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def __getitem__(self, name):
+    start, length = self._sections[name]
+    with self._lock:
+      if name not in self._values:
+        start += self._offset
+        with memoryview(self._mm) as view, \
+             view[start:start + length] as data:
+          self._values[name] = marshal.loads(data)
+      return self._values[name]
+
+  def __contains__(self, name):
+    return name in self._sections
+
+  def __iter__(self):
+    return iter(self._sections)
+
+  def __len__(self):
+    return len(self._sections)
+
+
+def _read_header(path, mm, kind, version, source_paths, verify_hash):
+  """Returns the payload offset and sections of a mapped image, or None if it
+  is not usable, see load()."""
+  magic, file_version, header_len = HEADER.unpack_from(mm, 0)
+  if magic != MAGIC or file_version != version:
+    logging.info('Snapshot {} has an unexpected version.'.format(path))
+    return None
+  offset = HEADER.size + header_len
+  try:
+    header = json.loads(mm[HEADER.size:offset].decode('utf-8'))
+  except ValueError:
+    header = None
+  if header is None or len(mm) != offset + header['size']:
+    logging.info('Snapshot {} is truncated.'.format(path))
+    return None
+  if header['kind'] != kind:
+    return None
+  if not _is_fresh(header['sources'], source_paths, verify_hash):
+    logging.info('Snapshot {} is stale.'.format(path))
+    return None
+  return offset, header['sections']
+
+
+def write(path, kind, version, source_paths, payload):
+  """Writes `payload`, a dict of section name to value, as an image of the
+  given kind and version.
+
+  The image is written and synced to a temporary file, which is then renamed
+  into place, so readers never see a partially written image.
+  """
+  data = {name: marshal.dumps(value) for name, value in payload.items()}
+  sections = {}
+  offset = 0
+  for name, value in data.items():
+    sections[name] = [offset, len(value)]
+    offset += len(value)
+  header = json.dumps({
+    'kind': kind,
+    'sources': fingerprint(source_paths),
+    'sections': sections,
+    'size': offset,
+  }).encode('utf-8')
+  tmp_path = '{}.tmp.{}'.format(path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, version, len(header)))
+    f.write(header)
+    for value in data.values():
+      f.write(value)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, path)
+
+
+def load(path, kind, version, source_paths, verify_hash=False):
+  """Maps an image and checks its header, see Sections.
+
+  Args:
+    path: Path of the image file.
+    kind: Expected payload kind.
+    version: Expected payload version.
+    source_paths: Source files the image must be fresh with respect to.
+    verify_hash: If True, also compare sha1 hashes of the sources, and not
+      just their size and mtime.
+
+  Returns:
+    The Sections of the payload, or None if the image is missing, truncated,
+    of a different kind or version, or stale with respect to its sources.
+  """
+  try:
+    f = open(path, 'rb')
+  except FileNotFoundError:
+    return None
+  with f:
+    if os.fstat(f.fileno()).st_size < HEADER.size:
+      logging.info('Snapshot {} is truncated.'.format(path))
+      return None
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  header = _read_header(path, mm, kind, version, source_paths, verify_hash)
+  if header is None:
+    mm.close()
+    return None
+  offset, sections = header
+  return Sections(mm, offset, sections)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""Dictionary backed by a sqlite database, see build_dict_db.py.
+
+SqliteDict exposes the same attributes as cdict.Dict, but only hydrates
+DictEntry objects on demand, keeping a bounded LRU of recently used entries.
+This suits short-lived tools and web workers that only ever look at a small
+part of the dictionary.
+"""
+
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+import os
+import sqlite3
+import threading
+
+from common import cdict
+from common.english_index import EnglishIndex
+from common.substring_index import SubstringIndex
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE entries (
+  id INTEGER PRIMARY KEY,
+  word TEXT NOT NULL UNIQUE,
+  traditional TEXT NOT NULL,
+  char_frequency REAL NOT NULL,
+  word_frequency REAL NOT NULL,
+  char_hsk_level INTEGER NOT NULL,
+  word_hsk_level INTEGER NOT NULL
+);
+CREATE INDEX entries_traditional ON entries (traditional);
+
+CREATE TABLE meanings (
+  entry_id INTEGER NOT NULL,
+  position INTEGER NOT NULL,
+  pinyin TEXT NOT NULL,
+  meaning TEXT NOT NULL,
+  PRIMARY KEY (entry_id, position)
+) WITHOUT ROWID;
+
+CREATE TABLE char_words (
+  char TEXT NOT NULL,
+  rank INTEGER NOT NULL,
+  word TEXT NOT NULL,
+  PRIMARY KEY (char, rank)
+) WITHOUT ROWID;
+
+-- The words of cdict.Dict.word_index, by position.
+CREATE TABLE word_index (
+  position INTEGER PRIMARY KEY,
+  word TEXT NOT NULL,
+  rank INTEGER NOT NULL
+);
+
+-- The words and postings of cdict.Dict.english_index.
+CREATE TABLE english_words (
+  position INTEGER PRIMARY KEY,
+  word TEXT NOT NULL
+);
+CREATE TABLE english_postings (
+  term TEXT PRIMARY KEY,
+  docs BLOB NOT NULL,
+  weights BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE chars_by_frequency (
+  rank INTEGER PRIMARY KEY,
+  char TEXT NOT NULL
+);
+
+-- `kind` is either 'char' or 'word'.
+CREATE TABLE hsk (
+  kind TEXT NOT NULL,
+  level INTEGER NOT NULL,
+  position INTEGER NOT NULL,
+  item TEXT NOT NULL,
+  PRIMARY KEY (kind, level, position)
+) WITHOUT ROWID;
+"""
+
+DEFAULT_CACHE_SIZE = 4096
+
+_ENTRY_COLUMNS = ('id, word, traditional, char_frequency, word_frequency, '
+                  'char_hsk_level, word_hsk_level')
+
+
+def build(data_dir, db_path):
+  """Compiles the dictionary source files in `data_dir` into a database.
+
+  The database is written in a single transaction to a temporary file, and
+  then moved over `db_path`.
+  """
+  d = cdict.Dict(data_dir)
+
+  tmp_path = db_path + '.tmp'
+  if os.path.exists(tmp_path):
+    os.remove(tmp_path)
+  conn = sqlite3.connect(tmp_path)
+  conn.execute('PRAGMA journal_mode=OFF')
+  conn.execute('PRAGMA synchronous=OFF')
+  conn.executescript(SCHEMA)
+  with conn:
+    entry_ids = {}
+    entry_rows = []
+    meaning_rows = []
+    for i, entry in enumerate(d.entries.values()):
+      entry_ids[entry.word] = i
+      entry_rows.append((i, entry.word, entry.traditional,
+                         entry.char_frequency, entry.word_frequency,
+                         entry.char_hsk_level, entry.word_hsk_level))
+      for j, meaning in enumerate(entry.meanings):
+        meaning_rows.append((i, j, meaning.pinyin, meaning.meaning))
+    conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     entry_rows)
+    conn.executemany('INSERT INTO meanings VALUES (?, ?, ?, ?)', meaning_rows)
+    conn.executemany(
+      'INSERT INTO char_words VALUES (?, ?, ?)',
+      ((char, rank, word) for char, words in d.char_to_words.items()
+       for word, rank in words))
+    conn.executemany(
+      'INSERT INTO word_index VALUES (?, ?, ?)',
+      ((i, word, rank) for i, (word, rank) in enumerate(
+        zip(d.word_index.words, d.word_index.ranks))))
+    english_index = EnglishIndex.build(d.entries)
+    conn.executemany('INSERT INTO english_words VALUES (?, ?)',
+                     enumerate(english_index.words))
+    conn.executemany(
+      'INSERT INTO english_postings VALUES (?, ?, ?)',
+      ((term, docs, weights)
+       for term, (docs, weights) in english_index.postings.items()))
+    conn.executemany('INSERT INTO chars_by_frequency VALUES (?, ?)',
+                     enumerate(d.chars_by_frequency))
+    for kind, levels in (('char', d.hsk_chars), ('word', d.hsk_words)):
+      conn.executemany(
+        'INSERT INTO hsk VALUES (?, ?, ?, ?)',
+        ((kind, level, position, item)
+         for level, items in enumerate(levels)
+         for position, item in enumerate(items)))
+    conn.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+  conn.execute('ANALYZE')
+  conn.close()
+  os.replace(tmp_path, db_path)
+
+
+class _EntryView(Mapping):
+  """Read-only mapping from a word (or traditional word) to a DictEntry."""
+
+  def __init__(self, d, column):
+    self._d = d
+    self._column = column
+
+  def __getitem__(self, key):
+    if self._column == 'word':
+      entry = self._d._get_entry(key)
+    else:
+      entry = self._d._get_traditional_entry(key)
+    if entry is None:
+      raise KeyError(key)
+    return entry
+
+  def __contains__(self, key):
+    return self._d._query_one(
+      'SELECT 1 FROM entries WHERE {}=? LIMIT 1'.format(self._column),
+      (key,)) is not None
+
+  def __iter__(self):
+    for (key,) in self._d._query_all(
+        'SELECT DISTINCT {0} FROM entries ORDER BY {0}'.format(self._column)):
+      yield key
+
+  def __len__(self):
+    return self._d._query_one(
+      'SELECT COUNT(DISTINCT {}) FROM entries'.format(self._column))[0]
+
+  def items(self):
+    """Yields (key, DictEntry) for all entries, bypassing the LRU."""
+    for entry in self._d._iter_entries():
+      yield getattr(entry, self._column), entry
+
+  def values(self):
+    for _, entry in self.items():
+      yield entry
+
+
+class _CharToWordsView(Mapping):
+  """Read-only mapping from a character to a list of (word, rank)."""
+
+  def __init__(self, d):
+    self._d = d
+
+  def __getitem__(self, char):
+    words = self._d._query_all(
+      'SELECT word, rank FROM char_words WHERE char=? ORDER BY rank', (char,))
+    if not words:
+      raise KeyError(char)
+    return words
+
+  def __contains__(self, char):
+    return self._d._query_one(
+      'SELECT 1 FROM char_words WHERE char=? LIMIT 1', (char,)) is not None
+
+  def __iter__(self):
+    for (char,) in self._d._query_all(
+        'SELECT DISTINCT char FROM char_words ORDER BY char'):
+      yield char
+
+  def __len__(self):
+    return self._d._query_one(
+      'SELECT COUNT(DISTINCT char) FROM char_words')[0]
+
+
+class _EnglishWordsView(Sequence):
+  """Read-only sequence of the words of the english index."""
+
+  def __init__(self, d):
+    self._d = d
+
+  def __getitem__(self, position):
+    row = self._d._query_one(
+      'SELECT word FROM english_words WHERE position=?', (position,))
+    if row is None:
+      raise IndexError(position)
+    return row[0]
+
+  def __len__(self):
+    return self._d._query_one('SELECT COUNT(*) FROM english_words')[0]
+
+
+class _EnglishPostingsView(Mapping):
+  """Read-only mapping from a term to the (docs, weights) of its posting."""
+
+  def __init__(self, d):
+    self._d = d
+
+  def __getitem__(self, term):
+    row = self._d._query_one(
+      'SELECT docs, weights FROM english_postings WHERE term=?', (term,))
+    if row is None:
+      raise KeyError(term)
+    return row
+
+  def __iter__(self):
+    for (term,) in self._d._query_all(
+        'SELECT term FROM english_postings ORDER BY term'):
+      yield term
+
+  def __len__(self):
+    return self._d._query_one('SELECT COUNT(*) FROM english_postings')[0]
+
+
+class SqliteDict:
+  """A dictionary for Chinese words and characters, backed by sqlite.
+
+  Has the same attributes as cdict.Dict. `entries`, `traditional_to_entry` and
+  `char_to_words` are read-only mappings which query the database on access,
+  the small HSK and frequency lists are read on first access. `word_index` is
+  read into memory on first access, `english_index` reads the postings of
+  each query term from the database.
+  """
+
+  def __init__(self, db_path, cache_size=DEFAULT_CACHE_SIZE):
+    self.conn = sqlite3.connect(
+      'file:{}?mode=ro'.format(db_path), uri=True, check_same_thread=False)
+    version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+    if version != SCHEMA_VERSION:
+      raise ValueError('{} has schema version {}, expected {}'.format(
+        db_path, version, SCHEMA_VERSION))
+    self._lock = threading.Lock()
+    self._cache = OrderedDict()
+    self._cache_size = cache_size
+    self._chars_by_frequency = None
+    self._hsk_chars = None
+    self._hsk_words = None
+    self._word_index = None
+
+    self.entries = _EntryView(self, 'word')
+    self.traditional_to_entry = _EntryView(self, 'traditional')
+    self.char_to_words = _CharToWordsView(self)
+    self.english_index = EnglishIndex(
+      _EnglishWordsView(self), _EnglishPostingsView(self))
+
+  def close(self):
+    self.conn.close()
+
+  @property
+  def chars_by_frequency(self):
+    if self._chars_by_frequency is None:
+      self._chars_by_frequency = [c for (c,) in self._query_all(
+        'SELECT char FROM chars_by_frequency ORDER BY rank')]
+    return self._chars_by_frequency
+
+  @property
+  def hsk_chars(self):
+    if self._hsk_chars is None:
+      self._hsk_chars = self._load_hsk('char')
+    return self._hsk_chars
+
+  @property
+  def hsk_words(self):
+    if self._hsk_words is None:
+      self._hsk_words = self._load_hsk('word')
+    return self._hsk_words
+
+  @property
+  def word_index(self):
+    if self._word_index is None:
+      rows = self._query_all(
+        'SELECT word, rank FROM word_index ORDER BY position')
+      self._word_index = SubstringIndex(
+        [word for word, _ in rows], array('I', [rank for _, rank in rows]))
+    return self._word_index
+
+  def search_english(self, query, limit=20):
+    """Returns words with meanings matching the English `query`, best first."""
+    return self.english_index.search(query, limit)
+
+  def _load_hsk(self, kind):
+    levels = []
+    for level, item in self._query_all(
+        'SELECT level, item FROM hsk WHERE kind=? ORDER BY level, position',
+        (kind,)):
+      while len(levels) <= level:
+        levels.append([])
+      levels[level].append(item)
+    return levels
+
+  def _query_one(self, sql, params=()):
+    with self._lock:
+      return self.conn.execute(sql, params).fetchone()
+
+  def _query_all(self, sql, params=()):
+    with self._lock:
+      return self.conn.execute(sql, params).fetchall()
+
+  def _get_entry(self, word):
+    with self._lock:
+      entry = self._cache.get(word)
+      if entry is not None:
+        self._cache.move_to_end(word)
+        return entry
+      row = self.conn.execute(
+        'SELECT {} FROM entries WHERE word=?'.format(_ENTRY_COLUMNS),
+        (word,)).fetchone()
+      if row is None:
+        return None
+      meanings = self.conn.execute(
+        'SELECT pinyin, meaning FROM meanings WHERE entry_id=? '
+        'ORDER BY position', (row[0],)).fetchall()
+      entry = self._hydrate(row, meanings)
+      self._cache[word] = entry
+      if len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+      return entry
+
+  def _get_traditional_entry(self, traditional):
+    # Like cdict.Dict, the last entry with a given traditional form wins.
+    row = self._query_one(
+      'SELECT word FROM entries WHERE traditional=? ORDER BY id DESC LIMIT 1',
+      (traditional,))
+    if row is None:
+      return None
+    return self._get_entry(row[0])
+
+  def _iter_entries(self):
+    """Yields all entries in id order, without caching them."""
+    with self._lock:
+      entry_rows = self.conn.execute(
+        'SELECT {} FROM entries ORDER BY id'.format(_ENTRY_COLUMNS)).fetchall()
+      meaning_rows = self.conn.execute(
+        'SELECT entry_id, pinyin, meaning FROM meanings '
+        'ORDER BY entry_id, position').fetchall()
+    m = 0
+    for row in entry_rows:
+      start = m
+      while m < len(meaning_rows) and meaning_rows[m][0] == row[0]:
+        m += 1
+      yield self._hydrate(row, [r[1:] for r in meaning_rows[start:m]])
+
+  @staticmethod
+  def _hydrate(row, meanings):
+    _, word, traditional, char_freq, word_freq, char_hsk, word_hsk = row
+    return cdict.DictEntry(
+      word, traditional,
+      [cdict.MeaningEntry(pinyin, meaning) for pinyin, meaning in meanings],
+      char_freq, word_freq, char_hsk, word_hsk)
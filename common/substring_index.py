@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Index for finding the words that contain a given substring.
+
+Words are numbered in frequency order, and each character has a sorted
+array('I') posting of the words containing it. The words containing a
+substring are then found by walking the shortest posting among its
+characters, so results come out most frequent first and a top-k query stops
+after k matches.
+"""
+
+from array import array
+
+
+class SubstringIndex:
+  """Substring index over a list of words.
+
+  Attributes:
+    words: The indexed words, most frequent first.
+    ranks: array('I') parallel to `words`, the rank of each word in the word
+      frequency list, or 0 for words not in that list.
+    postings: Map from a character to the array('I') of the positions in
+      `words` of all words containing it, in increasing order.
+  """
+
+  def __init__(self, words, ranks, postings=None):
+    self.words = words
+    self.ranks = ranks
+    if postings is None:
+      postings = {}
+      for i, word in enumerate(words):
+        for char in set(word):
+          posting = postings.get(char)
+          if posting is None:
+            posting = postings[char] = array('I')
+          posting.append(i)
+    self.postings = postings
+
+  def __contains__(self, substring):
+    return any(True for _ in self._iter_matches(substring))
+
+  def _iter_matches(self, substring):
+    if not substring:
+      return
+    posting = None
+    for char in set(substring):
+      char_posting = self.postings.get(char)
+      if char_posting is None:
+        return
+      if posting is None or len(char_posting) < len(posting):
+        posting = char_posting
+    words = self.words
+    if len(substring) == 1:
+      yield from posting
+    else:
+      for i in posting:
+        if substring in words[i]:
+          yield i
+
+  def count(self, char):
+    """Returns the number of words containing the character `char`."""
+    return len(self.postings.get(char, ()))
+
+  def search(self, substring, limit=None, known_words=None, known=None):
+    """Returns words containing `substring`, most frequent first.
+
+    Args:
+      substring: The substring to look for.
+      limit: If set, the maximum number of words to return.
+      known_words: A set of known words, used with `known`.
+      known: If True, only return words in `known_words`, if False only
+        words not in it.
+
+    Returns:
+      A list of tuples (word, rank).
+    """
+    result = []
+    if limit is not None and limit <= 0:
+      return result
+    for i in self._iter_matches(substring):
+      word = self.words[i]
+      if known is not None and (word in known_words) != known:
+        continue
+      result.append((word, self.ranks[i]))
+      if len(result) == limit:
+        break
+    return result
+
+  def to_payload(self):
+    """Returns the index as plain values for a snapshot, see from_payload()."""
+    return {
+      'words': self.words,
+      'ranks': self.ranks.tobytes(),
+      'postings': {c: p.tobytes() for c, p in self.postings.items()},
+    }
+
+  @classmethod
+  def from_payload(cls, payload):
+    ranks = array('I')
+    ranks.frombytes(payload['ranks'])
+    postings = {}
+    for char, raw in payload['postings'].items():
+      posting = postings[char] = array('I')
+      posting.frombytes(raw)
+    return cls(payload['words'], ranks, postings)
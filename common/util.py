@@ -2,7 +2,12 @@
 
 import re
 
-IS_CHINESE = re.compile(u'^[⺀-⺙⺛-⻳⼀-⿕々〇〡-〩〸-〺〻㐀-䶵一-\u9FC3豈-鶴侮-頻並-龎]+$', re.UNICODE)
+CHINESE_CHARS = u'⺀-⺙⺛-⻳⼀-⿕々〇〡-〩〸-〺〻㐀-䶵一-\u9FC3豈-鶴侮-頻並-龎'
+
+IS_CHINESE = re.compile(u'^[' + CHINESE_CHARS + u']+$', re.UNICODE)
+
+# Matches a maximal run of chinese characters.
+CHINESE_RUN = re.compile(u'[' + CHINESE_CHARS + u']+', re.UNICODE)
 
 def is_chinese(word):
   return IS_CHINESE.match(word) != None
@@ -1,67 +1,108 @@
 # Tool for printing some stats about the anki deck, and verifying some
 # assumptions I make about how cards are structured.
 # Also useful for testing the anki library.
+#
+# Usage:
+#   python3 -m common.verify_anki [report.json] [collection [note search db]]
+# The report is printed as JSON, and also written to report.json if given.
+# Without a collection, the configured collection and note search database
+# are used.
 
-import anki
-import config
+import json
+import sys
+import time
 
+from common import anki
+from common import config
 
-def check_character_deck(reader):
-  chars = reader.get_known_characters()
-  print('Verifying {} characters.'.format(len(chars)))
-  num_checked = 0
-  for char in chars:
-    notes = reader.get_character_cards(char)
-    if len(notes) == 0:
-      print('  {} has no cards, but is in known_characters'.format(char))
-    elif len(notes) > 1:
-      print('  {} has multiple character cards'.format(char))
-    num_checked += 1
-    if num_checked % 100 == 0:
-      print('  verified {} so far'.format(num_checked))
-  print()
 
-  
-def check_legacy_word_deck(reader):
-  words = reader.get_known_legacy_words()
-  print('Verifying {} legacy words.'.format(len(words)))
-  num_checked = 0
-  for word in words:
-    notes = reader.get_legacy_word_cards(word)
-    if len(notes) == 0:
-      print('  {} has no cards, but is in known_legacy_words'.format(word))
-    elif len(notes) > 1:
-      print('  {} has multiple legacy word cards'.format(word))    
-    num_checked += 1
-    if num_checked % 100 == 0:
-      print('  verified {} so far'.format(num_checked))
-  print()
+def _deck_key(deck_name):
+  return deck_name.replace(u'\x1f', '::')
 
 
-def check_word_deck(reader):
-  notes = reader.get_notes(u'Chinese\x1fGeneral')
-  print('Verifying {} general deck notes'.format(len(notes)))
-  legacy_general_notes = 0
-  notes_without_word = 0
-  for note in notes:
-    if len(note) == 2:
-      legacy_general_notes += 1
-      continue
-    if not note[3]:
-      print(note)
-      notes_without_word += 1
-  print('Found {} legacy general notes'.format(legacy_general_notes))
-  print('Found {} notes without a word on the back'.format(
-    notes_without_word))
-  print()
+def check_decks(reader):
+  """Checks the character and word decks in a single pass over their notes.
+
+  Returns a dict with, for each deck in anki.WORD_FIELDS, the number of
+  notes, the words with more than one note, the ids of notes without a word
+  and, for the general deck, the ids of legacy front/back notes. Also has the
+  number of notes in every deck of the collection. Deck names are written
+  with '::' between levels, as in the Anki UI.
+
+  This replaces looking up every known item on its own, which took minutes
+  on large collections. If the reader has a note search database, the
+  duplicates are found by a query on its index of fields instead.
+  """
+  deck_names = {deck_id: name for name, deck_id in reader.decks.items()}
+  report = {
+    'deck_sizes': {},
+    'decks': {},
+  }
+  for deck_id, num_notes in reader.c.execute(
+      'SELECT did, COUNT(DISTINCT nid) FROM cards GROUP BY did'):
+    if deck_id in deck_names:
+      report['deck_sizes'][_deck_key(deck_names[deck_id])] = num_notes
+
+  word_notes = {name: {} for name in anki.WORD_FIELDS}
+  deck_reports = {}
+  for name in anki.WORD_FIELDS:
+    deck_reports[name] = report['decks'][_deck_key(name)] = {
+      'notes': 0,
+      'duplicates': {},
+      'notes_without_word': [],
+      'legacy_notes': [],
+    }
+  for deck_id, note_id, flds in reader.c.execute(
+      'SELECT DISTINCT cards.did, notes.id, notes.flds FROM cards '
+      'JOIN notes ON notes.id=cards.nid WHERE cards.did IN ({}) '
+      'ORDER BY notes.id'.format(','.join('?' * len(anki.WORD_FIELDS))),
+      [reader.decks[name] for name in anki.WORD_FIELDS]):
+    name = deck_names[deck_id]
+    deck_report = deck_reports[name]
+    deck_report['notes'] += 1
+    note = flds.split(u'\u001f')
+    field = anki.WORD_FIELDS[name]
+    if len(note) <= field:
+      deck_report['legacy_notes'].append(note_id)
+    elif not note[field]:
+      deck_report['notes_without_word'].append(note_id)
+    else:
+      word_notes[name].setdefault(note[field], []).append(note_id)
+
+  for name, notes in word_notes.items():
+    if reader.note_search is not None:
+      duplicates = reader.note_search.duplicates(
+        reader.decks[name], anki.WORD_FIELDS[name])
+    else:
+      duplicates = {word: note_ids for word, note_ids in notes.items()
+                    if len(note_ids) > 1}
+    deck_reports[name]['duplicates'] = duplicates
+  return report
 
 
 if __name__ == "__main__":
-  reader = anki.AnkiReader(config.get_anki_collection())
-  for deck in reader.decks:
-    print('{} has {} notes'.format(deck, len(reader.get_notes(deck))))
-  print()
+  if len(sys.argv) > 2:
+    collection_path = sys.argv[2]
+    note_search_path = sys.argv[3] if len(sys.argv) > 3 else None
+  else:
+    collection_path = config.get_anki_collection()
+    note_search_path = config.get_anki_note_search_path()
+  start = time.time()
+  reader = anki.AnkiReader(collection_path,
+                           note_search_path=note_search_path)
+  report = check_decks(reader)
+  report['runtime_s'] = time.time() - start
 
-#  check_character_deck(reader)
-#  check_legacy_word_deck(reader)
-  check_word_deck(reader)
+  output = json.dumps(report, ensure_ascii=False, indent=2)
+  print(output)
+  if len(sys.argv) > 1:
+    with open(sys.argv[1], 'w') as f:
+      f.write(output)
+  for name, deck_report in report['decks'].items():
+    print('{}: {} notes, {} duplicated words, {} notes without a word, '
+          '{} legacy notes'.format(
+            name, deck_report['notes'],
+            len(deck_report['duplicates']),
+            len(deck_report['notes_without_word']),
+            len(deck_report['legacy_notes'])), file=sys.stderr)
+  print('Checked in {:.2f}s'.format(report['runtime_s']), file=sys.stderr)
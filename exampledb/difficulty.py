@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Vocabulary features of example sentences, for ranking them by difficulty.
+
+The features of a sentence are computed once, when it is stored: its words,
+the frequency ranks of those and the highest HSK level among them. Ranking
+the examples of a word for a learner is then a set difference with the
+learner's known words per sentence, without segmenting anything again.
+"""
+
+from collections import namedtuple
+
+from common import segmenter
+from common import util
+
+# words: frozenset of the distinct chinese words of the sentence.
+# max_rank, mean_rank: Highest and mean frequency rank of the words, where
+#   rank 1 is the most frequent word. Words without a rank count as rarer
+#   than all ranked words.
+# hsk_level: Highest HSK level of the words, with words in no HSK list
+#   counting as one level above the last.
+Features = namedtuple('Features',
+                      ['words', 'max_rank', 'mean_rank', 'hsk_level'])
+
+
+class Vocabulary:
+  """Computes sentence Features from a dictionary."""
+
+  def __init__(self, d):
+    """Builds the segmenter and word tables.
+
+    Args:
+      d: A cdict.Dict with word frequencies and HSK words loaded.
+    """
+    self.segmenter = segmenter.Segmenter(d.entries)
+    index = d.word_index
+    self.ranks = {word: rank for word, rank in zip(index.words, index.ranks)
+                  if rank}
+    self.unranked = max(self.ranks.values(), default=0) + 1
+    self.hsk_levels = {}
+    for level, words in enumerate(d.hsk_words, 1):
+      for word in words:
+        self.hsk_levels.setdefault(word, level)
+    self.unlisted_level = len(d.hsk_words) + 1
+
+  def features(self, chinese):
+    """Returns the Features of a sentence."""
+    words = frozenset(word for word in self.segmenter.segment(chinese)
+                      if util.is_chinese(word))
+    if not words:
+      return Features(words, 0, 0.0, 0)
+    ranks = [self.ranks.get(word, self.unranked) for word in words]
+    return Features(
+      words, max(ranks), sum(ranks) / len(ranks),
+      max(self.hsk_levels.get(word, self.unlisted_level) for word in words))
+
+
+def rank(features, known_words):
+  """Returns the indices of a list of Features, from the easiest sentence to
+  the hardest for a learner who knows `known_words`.
+
+  Sentences are ordered by their number of unknown words, then by HSK level
+  and mean frequency rank. Ties keep their order.
+  """
+  return sorted(range(len(features)), key=lambda i: (
+    len(features[i].words.difference(known_words)),
+    features[i].hsk_level, features[i].mean_rank, i))
@@ -3,81 +3,561 @@
 
 Combines a sqlite database stored in the data directory with scrapers
 to dynamically fetch more sentences.
+
+Each distinct sentence is stored once, keyed by a hash of its text without
+whitespace and punctuation, and linked to the words it is an example for.
+All stored sentences form a corpus, indexed by the characters they contain.
+Words without stored examples are looked up there first, so sentences
+scraped for one word serve all other words they contain.
+
+Given a difficulty.Vocabulary, the vocabulary features of each sentence are
+stored with it, for ranking examples by how many unknown words they have.
+
+Stored examples are served right away, and scraped again in the background
+once they are older than a TTL. Words for which scraping found nothing are
+only scraped again after a delay, which doubles with each failure.
 """
 
+import concurrent.futures
+import hashlib
+import logging
 import sqlite3
+import threading
 import time
+import unicodedata
 
+from common import util
+from exampledb import difficulty
 from exampledb import exampledb_pb2
 from exampledb import iciba
 from exampledb import linedict
 from exampledb import yellowbridge
 
-SCHEMA = """
-DROP TABLE IF EXISTS examples;
+# Seconds to wait for all scrapers together on a cache miss. Scrapers still
+# running then are abandoned, and their results dropped.
+SCRAPE_DEADLINE = 15.0
 
-CREATE TABLE examples (
-  word TEXT NOT NULL,
-  entry TEXT NOT NULL
+# Threads running scrapers, shared by all ExampleDbs of the process. A site
+# which hangs ties up a thread until its scraper's timeout.
+_scrape_executor = concurrent.futures.ThreadPoolExecutor(
+  max_workers=8, thread_name_prefix='scrape')
+
+# Threads scraping stale words again in the background, shared by all
+# ExampleDbs of the process, and the (database path, word) pairs queued.
+_refresh_executor = concurrent.futures.ThreadPoolExecutor(
+  max_workers=2, thread_name_prefix='refresh')
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# Default seconds after which stored examples are scraped again. Longer than
+# the default TTL of fetch.ResponseCache, so the pages are fetched again.
+EXAMPLE_TTL = 180 * 24 * 60 * 60
+# Seconds to wait before scraping a word again after the first scrape which
+# found nothing. Doubles with each further failure, up to the maximum.
+FAILURE_BACKOFF = 60.0
+MAX_FAILURE_BACKOFF = 7 * 24 * 60 * 60
+
+# A word with at least this many examples in the corpus is not scraped.
+MIN_LOCAL_EXAMPLES = 5
+# Maximum number of examples returned from the corpus.
+MAX_LOCAL_EXAMPLES = 20
+
+# Version of the schema, stored as the database's user_version. Versions
+# up to 2 stored a serialized WordEntry per word in the examples table,
+# version 3 lacks the sentence features and version 4 the failed scrapes,
+# see ExampleDb._migrate().
+SCHEMA_VERSION = 5
+
+# Tables of the current and older versions.
+_TABLES = ['examples', 'sentences', 'word_sentences', 'sentence_chars',
+           'corpus_chars', 'failed_scrapes']
+
+# Each distinct sentence, with its id the sentence_key() of its text and
+# its difficulty.Features, NULL until computed. The examples of each word, in
+# order, as links to sentences. The sentences containing each chinese
+# character, and the number of those. The words whose last scrapes found
+# nothing, with the number of those and when to try again.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sentences (
+  id INTEGER PRIMARY KEY,
+  chinese TEXT NOT NULL,
+  english TEXT NOT NULL,
+  words TEXT,
+  max_rank INTEGER,
+  mean_rank REAL,
+  hsk_level INTEGER
 );
+CREATE TABLE IF NOT EXISTS word_sentences (
+  word TEXT NOT NULL,
+  pos INTEGER NOT NULL,
+  sentence_id INTEGER NOT NULL,
+  source INTEGER NOT NULL,
+  created_ts REAL NOT NULL,
+  PRIMARY KEY (word, pos)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_word_sentences_sentence
+  ON word_sentences (sentence_id);
+CREATE TABLE IF NOT EXISTS sentence_chars (
+  char TEXT NOT NULL,
+  sentence_id INTEGER NOT NULL,
+  PRIMARY KEY (char, sentence_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS corpus_chars (
+  char TEXT PRIMARY KEY,
+  count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS failed_scrapes (
+  word TEXT PRIMARY KEY,
+  failures INTEGER NOT NULL,
+  retry_ts REAL NOT NULL
+) WITHOUT ROWID;
 """
 
+# Unicode categories ignored when comparing sentences: punctuation,
+# separators and control characters.
+_IGNORED_CATEGORIES = ('P', 'Z', 'C')
+# The characters of the basic multilingual plane in those categories, for
+# str.translate(), which is much faster than checking every character.
+_IGNORED_BMP = {c: None for c in range(0x10000)
+                if unicodedata.category(chr(c))[0] in _IGNORED_CATEGORIES}
+
+
+def sentence_key(chinese):
+  """Returns the id of a sentence, a 64 bit hash of its text.
+
+  Sentences which only differ in whitespace, punctuation or full width
+  forms have the same key. Returns None for sentences without any other
+  characters.
+  """
+  text = unicodedata.normalize('NFKC', chinese).lower().translate(_IGNORED_BMP)
+  if text and max(text) > '\uffff':
+    text = ''.join(c for c in text if c <= '\uffff' or
+                   unicodedata.category(c)[0] not in _IGNORED_CATEGORIES)
+  if not text:
+    return None
+  digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+  return int.from_bytes(digest, 'little', signed=True)
+
+
+# Number of sentence ids per query when fetching sentences by id.
+_FETCH_BATCH = 500
+
+
+def _features_row(features):
+  """Returns difficulty.Features as values of the sentences columns."""
+  return (' '.join(sorted(features.words)), features.max_rank,
+          features.mean_rank, features.hsk_level)
+
+
+def make_entry(word, scraped):
+  """Returns a WordEntry with examples from (source, sentences) tuples."""
+  entry = exampledb_pb2.WordEntry()
+  entry.word = word
+  for source, sentences in scraped:
+    for chinese, english in sentences:
+      example = entry.examples.add()
+      example.chinese = chinese
+      example.english = english
+      example.source = source
+      example.created_ts = time.time()
+  return entry
+
+
 class ExampleDb:
 
-  def __init__(self, db_path):
-    self.conn = sqlite3.connect(db_path)
+  def __init__(self, db_path, scrape_deadline=SCRAPE_DEADLINE,
+               response_cache=None, min_local_examples=MIN_LOCAL_EXAMPLES,
+               vocabulary=None, example_ttl=EXAMPLE_TTL,
+               failure_backoff=FAILURE_BACKOFF):
+    """Opens the database, migrating it to the current schema.
+
+    Args:
+      db_path: Path of the sqlite database.
+      scrape_deadline: Seconds to wait for all scrapers on a cache miss.
+      response_cache: If set, a fetch.ResponseCache for the scrapers.
+      min_local_examples: Words with fewer examples in the corpus are
+        scraped.
+      vocabulary: If set, a difficulty.Vocabulary to compute the features
+        of new sentences with. Needed by get_ranked_examples().
+      example_ttl: Seconds after which get_examples() scrapes stored
+        examples again in the background, or None to never do that.
+      failure_backoff: Seconds to wait before scraping a word again after
+        a scrape found nothing, doubled for each further failure.
+    """
+    self.db_path = db_path
+    self.scrape_deadline = scrape_deadline
+    self.min_local_examples = min_local_examples
+    # Set before migrating, which stores sentences and their features.
+    self.vocabulary = vocabulary
+    self.example_ttl = example_ttl
+    self.failure_backoff = failure_backoff
+    # ExampleDbs may be shared between threads through a common.pool.Pool,
+    # which only hands them to one thread at a time.
+    self.conn = sqlite3.connect(db_path, check_same_thread=False)
+    # With a write-ahead log, readers don't block the writer or each other,
+    # and commits need no fsync until a checkpoint.
+    self.conn.execute('PRAGMA journal_mode=WAL')
+    self.conn.execute('PRAGMA synchronous=NORMAL')
+    self._migrate()
     self.scrapers = {
 # ICIBA is disabled because the scraper is currently broken.
 #      exampledb_pb2.Example.ICIBA: iciba.IcibaScraper(),
       exampledb_pb2.Example.LINEDICT: linedict.LineDictScraper(),
       exampledb_pb2.Example.YELLOWBRIDGE: yellowbridge.YellowBridgeScraper(),
     }
+    for scraper in self.scrapers.values():
+      scraper.cache = response_cache
 
   def create(self):
-    """Drops any existing table and creates a new one."""
+    """Drops any existing tables and creates new ones."""
+    self._drop_tables(_TABLES)
     self.conn.executescript(SCHEMA)
+    self.conn.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+
+  def _drop_tables(self, tables):
+    self.conn.executescript(''.join(
+      'DROP TABLE IF EXISTS {};'.format(table) for table in tables))
+
+  def _migrate(self):
+    """Brings a database written by an older version up to date."""
+    version, = self.conn.execute('PRAGMA user_version').fetchone()
+    if version == SCHEMA_VERSION:
+      return
+    if version > SCHEMA_VERSION:
+      raise ValueError('Example database has schema version {}, newer than '
+                       '{}'.format(version, SCHEMA_VERSION))
+    if version >= 3:
+      with self.conn:
+        if version < 4:
+          # Features are computed when next needed.
+          for column in ('words TEXT', 'max_rank INTEGER', 'mean_rank REAL',
+                         'hsk_level INTEGER'):
+            self.conn.execute(
+              'ALTER TABLE sentences ADD COLUMN {}'.format(column))
+        if version < 5:
+          self.conn.execute(
+            'CREATE TABLE failed_scrapes (word TEXT PRIMARY KEY, '
+            'failures INTEGER NOT NULL, retry_ts REAL NOT NULL) WITHOUT ROWID')
+        self.conn.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+      return
+    has_examples = self.conn.execute(
+      "SELECT 1 FROM sqlite_master WHERE type='table' AND name='examples'"
+      ).fetchone()
+    if not has_examples:
+      self.create()
+      return
+    # Rebuild everything from the WordEntry blobs of the examples table,
+    # which is only dropped at the end, so this can be repeated if it fails
+    # half way. Creating tables commits, so do that first.
+    logging.info('Moving example sentences out of the examples table')
+    self._drop_tables(_TABLES[1:])
+    self.conn.executescript(SCHEMA)
+    with self.conn:
+      # Version 0 could store a word more than once, the latest one wins.
+      for raw_entry, in self.conn.execute(
+          'SELECT entry FROM examples ORDER BY rowid'):
+        self._store_entry(exampledb_pb2.WordEntry.FromString(raw_entry))
+      self.conn.execute('DROP TABLE examples')
+      self.conn.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+    # Give the space of the blobs back.
+    self.conn.execute('VACUUM')
 
   def close(self):
     self.conn.close()
 
+  def get_words(self):
+    """Returns the set of words with stored examples."""
+    return {word for word, in self.conn.execute(
+      'SELECT DISTINCT word FROM word_sentences')}
+
   def insert_entry(self, entry : exampledb_pb2.WordEntry):
-    assert entry.HasField('word')
-    assert len(entry.examples) > 0
+    self.insert_entries([entry])
 
-    raw_entry = entry.SerializeToString()
-    self.conn.execute('INSERT INTO examples (word, entry) VALUES (?, ?)',
-                      (entry.word, raw_entry))
-    self.conn.commit()
+  def insert_entries(self, entries):
+    """Inserts WordEntry protos in one transaction, replacing the stored
+    examples of their words."""
+    for entry in entries:
+      assert entry.HasField('word')
+      assert len(entry.examples) > 0
+    with self.conn:
+      for entry in entries:
+        self._store_entry(entry)
+
+  def _store_entry(self, entry):
+    """Replaces the examples of a word, in the current transaction.
+
+    Sentences only used by the old examples are dropped. Duplicate examples
+    are skipped. Failed scrapes of the word are forgotten.
+    """
+    old_ids = {sentence_id for sentence_id, in self.conn.execute(
+      'SELECT sentence_id FROM word_sentences WHERE word=?', (entry.word,))}
+    self.conn.execute('DELETE FROM word_sentences WHERE word=?', (entry.word,))
+    links = []
+    ids = set()
+    for example in entry.examples:
+      sentence_id = self._add_sentence(example)
+      if sentence_id is None or sentence_id in ids:
+        continue
+      ids.add(sentence_id)
+      links.append((entry.word, len(links), sentence_id, example.source,
+                    example.created_ts))
+    self.conn.executemany(
+      'INSERT INTO word_sentences (word, pos, sentence_id, source, '
+      'created_ts) VALUES (?, ?, ?, ?, ?)', links)
+    for sentence_id in old_ids - ids:
+      self._remove_if_unused(sentence_id)
+    self.conn.execute('DELETE FROM failed_scrapes WHERE word=?', (entry.word,))
+
+  def _add_sentence(self, example):
+    """Adds the sentence of an Example proto to the corpus, unless it is
+    there already, and returns its id."""
+    sentence_id = sentence_key(example.chinese)
+    if sentence_id is None:
+      return None
+    features = (None,) * 4
+    if self.vocabulary is not None:
+      features = _features_row(self.vocabulary.features(example.chinese))
+    cursor = self.conn.execute(
+      'INSERT OR IGNORE INTO sentences (id, chinese, english, words, '
+      'max_rank, mean_rank, hsk_level) VALUES (?, ?, ?, ?, ?, ?, ?)',
+      (sentence_id, example.chinese, example.english) + features)
+    if cursor.rowcount == 0:
+      # Already in the corpus, maybe without a translation.
+      if example.english:
+        self.conn.execute(
+          "UPDATE sentences SET english=? WHERE id=? AND english=''",
+          (example.english, sentence_id))
+      return sentence_id
+    chars = [c for c in set(example.chinese) if util.is_chinese(c)]
+    self.conn.executemany(
+      'INSERT INTO sentence_chars (char, sentence_id) VALUES (?, ?)',
+      [(c, sentence_id) for c in chars])
+    self.conn.executemany(
+      'INSERT INTO corpus_chars (char, count) VALUES (?, 1) '
+      'ON CONFLICT (char) DO UPDATE SET count=count+1',
+      [(c,) for c in chars])
+    return sentence_id
+
+  def _remove_if_unused(self, sentence_id):
+    """Removes a sentence from the corpus if no word links to it."""
+    if self.conn.execute(
+        'SELECT 1 FROM word_sentences WHERE sentence_id=?',
+        (sentence_id,)).fetchone():
+      return
+    chars = self.conn.execute(
+      'SELECT char FROM sentence_chars WHERE sentence_id=?',
+      (sentence_id,)).fetchall()
+    self.conn.executemany(
+      'UPDATE corpus_chars SET count=count-1 WHERE char=?', chars)
+    self.conn.execute(
+      'DELETE FROM sentence_chars WHERE sentence_id=?', (sentence_id,))
+    self.conn.execute('DELETE FROM sentences WHERE id=?', (sentence_id,))
+
+  def get_stored_examples(self, word):
+    """Returns the stored examples of a word as a list of Example protos."""
+    return [exampledb_pb2.Example(chinese=chinese, english=english,
+                                  source=source, created_ts=created_ts)
+            for chinese, english, source, created_ts in self.conn.execute(
+              'SELECT s.chinese, s.english, w.source, w.created_ts '
+              'FROM word_sentences AS w JOIN sentences AS s '
+              'ON s.id=w.sentence_id WHERE w.word=? ORDER BY w.pos', (word,))]
+
+  def get_features(self, examples):
+    """Returns the difficulty.Features of the sentences of Example protos.
+
+    Features missing from the database are computed and stored.
+    """
+    ids = [sentence_key(example.chinese) for example in examples]
+    stored = {}
+    unique_ids = list(set(ids))
+    for i in range(0, len(unique_ids), _FETCH_BATCH):
+      batch = unique_ids[i:i + _FETCH_BATCH]
+      for sentence_id, words, max_rank, mean_rank, hsk_level in (
+          self.conn.execute(
+            'SELECT id, words, max_rank, mean_rank, hsk_level FROM sentences '
+            'WHERE words IS NOT NULL AND id IN ({})'.format(
+              ','.join('?' * len(batch))), batch)):
+        stored[sentence_id] = difficulty.Features(
+          frozenset(words.split()), max_rank, mean_rank, hsk_level)
+    computed = []
+    for sentence_id, example in zip(ids, examples):
+      if sentence_id not in stored:
+        stored[sentence_id] = self.vocabulary.features(example.chinese)
+        computed.append(
+          _features_row(stored[sentence_id]) + (sentence_id,))
+    if computed:
+      with self.conn:
+        self.conn.executemany(
+          'UPDATE sentences SET words=?, max_rank=?, mean_rank=?, '
+          'hsk_level=? WHERE id=?', computed)
+    return [stored[sentence_id] for sentence_id in ids]
+
+  def search_corpus(self, word, limit=MAX_LOCAL_EXAMPLES):
+    """Returns Example protos of corpus sentences containing `word`.
+
+    Walks the sentences containing the rarest character of the word, and
+    stops after `limit` matches.
+    """
+    chars = [c for c in set(word) if util.is_chinese(c)]
+    if not chars:
+      return []
+    counts = dict(self.conn.execute(
+      'SELECT char, count FROM corpus_chars WHERE char IN ({})'.format(
+        ','.join('?' * len(chars))), chars))
+    if len(chars) > sum(1 for c in chars if counts.get(c)):
+      return []
+    rarest = min(chars, key=counts.get)
+    # A sentence linked to several words gets the source and time of its
+    # earliest link.
+    examples = []
+    for chinese, english, source, created_ts in self.conn.execute(
+        'SELECT s.chinese, s.english, w.source, MIN(w.created_ts) '
+        'FROM sentence_chars AS c JOIN sentences AS s ON s.id=c.sentence_id '
+        'JOIN word_sentences AS w ON w.sentence_id=s.id '
+        'WHERE c.char=? AND instr(s.chinese, ?) > 0 '
+        'GROUP BY c.sentence_id ORDER BY c.sentence_id LIMIT ?',
+        (rarest, word, limit)):
+      examples.append(exampledb_pb2.Example(
+        chinese=chinese, english=english, source=source,
+        created_ts=created_ts))
+    return examples
+
+  def scrape(self, word):
+    """Runs all scrapers for the given word concurrently.
+
+    Each scraper gets its own timeout, and all of them together
+    self.scrape_deadline. Scrapers which fail or time out are logged and
+    skipped.
+
+    Yields tuples (source, sentences) as scrapers finish.
+    """
+    start = time.time()
+    deadline = start + self.scrape_deadline
+    pending = {}
+    for source, scraper in self.scrapers.items():
+      future = _scrape_executor.submit(scraper.get_sentences, word)
+      pending[future] = (source, min(start + scraper.timeout, deadline))
+    while pending:
+      next_deadline = min(d for _, d in pending.values())
+      done, _ = concurrent.futures.wait(
+        pending, timeout=max(next_deadline - time.time(), 0),
+        return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        source, _ = pending.pop(future)
+        try:
+          sentences = future.result()
+        except Exception:
+          logging.exception('Scraping {} for {} failed'.format(
+            exampledb_pb2.Example.Source.Name(source), word))
+          continue
+        yield source, sentences
+      now = time.time()
+      for future, (source, source_deadline) in list(pending.items()):
+        if source_deadline <= now:
+          future.cancel()
+          del pending[future]
+          logging.warning('Scraping {} for {} timed out after {:.1f}s'.format(
+            exampledb_pb2.Example.Source.Name(source), word, now - start))
+
+  def get_ranked_examples(self, word, known_words):
+    """Like get_examples(), but ordered from the easiest example to the
+    hardest for a learner who knows the set `known_words`.
+
+    Needs self.vocabulary.
+    """
+    examples = self.get_examples(word)
+    order = difficulty.rank(self.get_features(examples), known_words | {word})
+    return [examples[i] for i in order]
+
+  def _queue_refresh(self, word):
+    """Scrapes a word again in the background, unless already queued."""
+    key = (self.db_path, word)
+    with _refreshing_lock:
+      if key in _refreshing:
+        return
+      _refreshing.add(key)
+    _refresh_executor.submit(self._refresh, word)
+
+  def _refresh(self, word):
+    """Replaces the stored examples of a word with newly scraped ones.
+
+    Runs in a refresh thread, so it writes through a connection of its own.
+    If scraping finds nothing, e.g. because the sites are down, the old
+    examples are kept, and the failure delays the next refresh like that of
+    any other scrape.
+    """
+    try:
+      entry = make_entry(word, self.scrape(word))
+      db = ExampleDb(self.db_path, vocabulary=self.vocabulary,
+                     failure_backoff=self.failure_backoff)
+      try:
+        if entry.examples:
+          db.insert_entry(entry)
+        else:
+          logging.warning('Refreshing examples of {} found none'.format(word))
+          db._record_failure(word)
+      finally:
+        db.close()
+    except Exception:
+      logging.exception('Refreshing examples of {} failed'.format(word))
+    finally:
+      with _refreshing_lock:
+        _refreshing.discard((self.db_path, word))
+
+  def _scrape_allowed(self, word):
+    """Returns False while a word waits to be scraped again after a scrape
+    which found nothing."""
+    row = self.conn.execute(
+      'SELECT retry_ts FROM failed_scrapes WHERE word=?', (word,)).fetchone()
+    return row is None or row[0] <= time.time()
+
+  def _record_failure(self, word):
+    failures, = self.conn.execute(
+      'SELECT COALESCE(MAX(failures), 0) + 1 FROM failed_scrapes WHERE word=?',
+      (word,)).fetchone()
+    delay = min(self.failure_backoff * 2 ** (failures - 1),
+                MAX_FAILURE_BACKOFF)
+    with self.conn:
+      self.conn.execute(
+        'INSERT OR REPLACE INTO failed_scrapes (word, failures, retry_ts) '
+        'VALUES (?, ?, ?)', (word, failures, time.time() + delay))
 
   def get_examples(self, word):
     """Get example sentences for the given word.
 
     Returns a list of Example protos.
     """
-    row = self.conn.execute('SELECT entry FROM examples WHERE word=?',
-                            (word,)).fetchone()
-    if row is not None:
-      entry = exampledb_pb2.WordEntry.FromString(row[0])
-      return list(entry.examples)
-    else:
-      # Try scraping for example sentences.
-      entry = exampledb_pb2.WordEntry()
-      entry.word = word
-
-      for source, scraper in self.scrapers.items():
-        sentences = scraper.get_sentences(word)
-        for chinese, english in sentences:
-          example = entry.examples.add()
-          example.chinese = chinese
-          example.english = english
-          example.source = source
-          example.created_ts = time.time()
- 
-      # Don't put an empty entry into the database.
-      # Maybe all scrapers failed and we want to try again.
-      if not entry.examples:
-        return []
-
-      # Save the entry in the DB.
-      self.insert_entry(entry)
-      return list(entry.examples)
+    examples = self.get_stored_examples(word)
+    if examples:
+      # Examples merged in from the corpus may be older than the scrape.
+      scraped_ts = max(example.created_ts for example in examples)
+      if (self.example_ttl is not None and
+          time.time() - scraped_ts > self.example_ttl and
+          self._scrape_allowed(word)):
+        self._queue_refresh(word)
+      return examples
+
+    # Sentences stored for other words may be enough.
+    local_examples = self.search_corpus(word)
+    if len(local_examples) >= self.min_local_examples:
+      return local_examples
+
+    # Don't hit the sites on every view of a word they have nothing for.
+    if not self._scrape_allowed(word):
+      return local_examples
+
+    # Try scraping for example sentences.
+    entry = make_entry(word, self.scrape(word))
+
+    # Don't put an empty entry into the database.
+    # Maybe all scrapers failed and we want to try again later. If only some
+    # failed, the others' examples are kept.
+    if not entry.examples:
+      self._record_failure(word)
+      return local_examples
+
+    # Save the entry in the DB, with the corpus sentences found. Storing
+    # drops the duplicates.
+    entry.examples.extend(local_examples)
+    self.insert_entry(entry)
+    return self.get_stored_examples(word)
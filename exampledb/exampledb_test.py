@@ -4,16 +4,59 @@ To make Python imports happy, run this as:
 python3 -m exampledb.exampledb_test from the top level.
 
 Not really a test, just a useful tool for double checking the db code does
-something.
+something. Also checks that a database in the original format, one
+serialized WordEntry per row of the examples table, is migrated.
 TODO(piotrf): make this actually a test
 """
 
 import os
+import sqlite3
+import tempfile
+import time
 
 from common import config
 from exampledb import exampledb
+from exampledb import exampledb_pb2
+
+
+def make_baseline_db(db_path):
+  """Writes an example database in the original format, with a word stored
+  twice as that format allowed."""
+  conn = sqlite3.connect(db_path)
+  conn.execute('CREATE TABLE examples (word TEXT NOT NULL, '
+               'entry TEXT NOT NULL)')
+  for word, sentences in [(u'加剧', [u'冲突加剧了。']),
+                          (u'加剧', [u'冲突加剧了。', u'竞争日益加剧。']),
+                          (u'竞争', [u'竞争日益加剧！'])]:
+    entry = exampledb.make_entry(
+      word, [(exampledb_pb2.Example.LINEDICT,
+              [(sentence, 'english') for sentence in sentences])])
+    conn.execute('INSERT INTO examples (word, entry) VALUES (?, ?)',
+                 (word, entry.SerializeToString()))
+  conn.commit()
+  conn.close()
+
+
+def check_migration():
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    db_path = os.path.join(tmp_dir, 'examples.db')
+    make_baseline_db(db_path)
+    db = exampledb.ExampleDb(db_path)
+    version, = db.conn.execute('PRAGMA user_version').fetchone()
+    assert version == exampledb.SCHEMA_VERSION, version
+    assert db.get_words() == {u'加剧', u'竞争'}
+    # The latest row of 加剧 wins, and the sentence of 竞争 only differs
+    # from one of those in punctuation.
+    assert [e.chinese for e in db.get_stored_examples(u'加剧')] == [
+      u'冲突加剧了。', u'竞争日益加剧。']
+    assert [e.chinese for e in db.get_stored_examples(u'竞争')] == [
+      u'竞争日益加剧。']
+    db.close()
+  print('Migration of the original format OK')
+
 
 if __name__ == "__main__":
+  check_migration()
   db = exampledb.ExampleDb(config.get_example_db_path())
   examples = db.get_examples(u'加剧')
   for example in examples:
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the sites the scrapers fetch from.
+
+Serves made up example sentences in the formats of linedict and
+yellowbridge, optionally slowly or with failures, for trying out
+prefetch_examples.py without touching the real sites. The page builders
+also make the synthetic fixtures of measure_scraper_parsing.py.
+
+Run from the top level as:
+python3 -m exampledb.fake_sites --port=8000
+and pass --local_server=http://localhost:8000 to prefetch_examples.py.
+"""
+
+from absl import app
+from absl import flags
+import gzip
+import html
+import http.server
+import json
+import logging
+import random
+import time
+import urllib.parse
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('port', 8000, 'Port to listen on.')
+flags.DEFINE_float('latency', 0.05, 'Seconds to wait before each response.')
+flags.DEFINE_float('failure_rate', 0.0,
+                   'Fraction of requests answered with a server error.')
+flags.DEFINE_integer('num_sentences', 5, 'Sentences returned per word.')
+
+
+def make_sentences(word, num_sentences=None):
+  if num_sentences is None:
+    num_sentences = FLAGS.num_sentences
+  return [(u'{}的例句{}。'.format(word, i), 'Example {} for {}.'.format(i, word))
+          for i in range(num_sentences)]
+
+
+def linedict_page(sentences):
+  """Returns a linedict search response with the given sentences, with
+  some of the other fields of the real one."""
+  return json.dumps({
+    'pager': {'page': 1, 'pageSize': 20, 'totalCount': len(sentences)},
+    'exampleList': [{
+      'example': zh,
+      'translation': en,
+      'exampleId': i,
+      'origin': 'corpus',
+      'lang': 'zh',
+      'exampleAudio': None,
+      'source': {'name': 'Example source', 'link': ''},
+    } for i, (zh, en) in enumerate(sentences)],
+  }, ensure_ascii=False)
+
+
+# Navigation around the sentences of a yellowbridge page.
+_YELLOWBRIDGE_HEADER = (
+  '<html><head><title>Sentences</title>'
+  '<script>var ads = [];</script></head><body><ul class="nav">' +
+  ''.join('<li><a href="/chinese/page{0}.php">Page {0}</a></li>'.format(i)
+          for i in range(100)) + '</ul><div id="sentences">')
+_YELLOWBRIDGE_FOOTER = '</div><div class="footer">Footer</div></body></html>'
+
+
+def yellowbridge_page(word, sentences):
+  """Returns a yellowbridge search page with the given sentences. The word
+  is a link in each sentence, followed by a circled digit like the
+  tooltip markers of the real site."""
+  link = u'<a href="/chinese/dictionary.php?word={0}">{0}</a>\u2460'.format(
+    html.escape(word))
+  return (_YELLOWBRIDGE_HEADER + ''.join(
+    '<p><span class="zh">{}</span><br>{}</p>'.format(
+      html.escape(zh).replace(html.escape(word), link), html.escape(en))
+    for zh, en in sentences) + _YELLOWBRIDGE_FOOTER)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+  # Keep connections alive, like the real sites. Headers and body are
+  # separate writes, so Nagle's algorithm would delay each response.
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def do_GET(self):
+    time.sleep(FLAGS.latency)
+    if random.random() < FLAGS.failure_rate:
+      self.send_error(503)
+      return
+    url = urllib.parse.urlsplit(self.path)
+    params = urllib.parse.parse_qs(url.query)
+    if url.path == '/cnen/example/search.dict':
+      body = linedict_page(make_sentences(params['query'][0]))
+      content_type = 'application/json'
+    elif url.path == '/chinese/sentsearch.php':
+      word = params['word'][0]
+      body = yellowbridge_page(word, make_sentences(word))
+      content_type = 'text/html; charset=utf-8'
+    else:
+      self.send_error(404)
+      return
+    data = body.encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', content_type)
+    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+      data = gzip.compress(data)
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    logging.debug(format, *args)
+
+
+def main(argv):
+  server = http.server.ThreadingHTTPServer(('localhost', FLAGS.port), Handler)
+  logging.info('Serving on port {}'.format(FLAGS.port))
+  server.serve_forever()
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,238 @@
+"""HTTP client and response cache shared by the scrapers.
+
+HttpClient keeps a pool of keep-alive connections per host, asks for
+compressed responses and follows redirects. ResponseCache stores response
+bodies on disk, named by a hash of their URL, so that scraping a word again,
+e.g. after fixing a parser, needs no requests.
+"""
+
+import gzip
+import hashlib
+import http.client
+import logging
+import os
+import struct
+import threading
+import time
+import urllib.parse
+import zlib
+
+from common import pool
+
+# Default seconds to wait for a connection or data.
+DEFAULT_TIMEOUT = 10.0
+# Default maximum number of open connections to each host.
+DEFAULT_CONNECTIONS_PER_HOST = 4
+MAX_REDIRECTS = 5
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Defaults for ResponseCache.
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# Header of cache files: the time the response was fetched.
+_CACHE_HEADER = struct.Struct('<d')
+
+
+class HttpError(Exception):
+  """A response with a status other than 200."""
+
+  def __init__(self, url, status):
+    super().__init__('HTTP {} for {}'.format(status, url))
+    self.url = url
+    self.status = status
+
+
+def _decode(body, encoding):
+  if encoding == 'gzip':
+    return gzip.decompress(body)
+  if encoding == 'deflate':
+    try:
+      return zlib.decompress(body)
+    except zlib.error:
+      # Some servers send raw deflate data without the zlib header.
+      return zlib.decompress(body, -zlib.MAX_WBITS)
+  return body
+
+
+class HttpClient:
+  """Thread-safe HTTP client with keep-alive connections to each host."""
+
+  def __init__(self, connections_per_host=DEFAULT_CONNECTIONS_PER_HOST):
+    self.connections_per_host = connections_per_host
+    self._lock = threading.Lock()
+    # Map from (scheme, host) to a pool of connections.
+    self._pools = {}
+
+  def _pool(self, scheme, host):
+    with self._lock:
+      connections = self._pools.get((scheme, host))
+      if connections is None:
+        if scheme == 'https':
+          factory = lambda: http.client.HTTPSConnection(host)
+        elif scheme == 'http':
+          factory = lambda: http.client.HTTPConnection(host)
+        else:
+          raise ValueError('Unsupported URL scheme {}'.format(scheme))
+        connections = self._pools[scheme, host] = pool.Pool(
+          factory, self.connections_per_host)
+      return connections
+
+  def _request(self, url, headers, timeout):
+    """Returns the response and body of one GET request."""
+    parts = urllib.parse.urlsplit(url)
+    path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    connections = self._pool(parts.scheme, parts.netloc)
+    with connections.get() as conn:
+      for attempt in range(2):
+        reused = conn.sock is not None
+        conn.timeout = timeout
+        if reused:
+          conn.sock.settimeout(timeout)
+        try:
+          conn.request('GET', path, headers=headers)
+          response = conn.getresponse()
+          body = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError,
+                BrokenPipeError):
+          conn.close()
+          # The server may have closed an idle connection, so try once
+          # more on a new one.
+          if reused and attempt == 0:
+            continue
+          raise
+        except BaseException:
+          # Don't reuse a connection in an unknown state.
+          conn.close()
+          raise
+        break
+      if response.will_close:
+        conn.close()
+    return response, body
+
+  def get(self, url, headers=None, timeout=DEFAULT_TIMEOUT):
+    """Returns the decompressed body of the response to a GET request.
+
+    Raises:
+      HttpError: If the final response has a status other than 200, or is a
+        redirect without a Location.
+    """
+    request_headers = {
+      'Accept-Encoding': 'gzip, deflate',
+    }
+    request_headers.update(headers or {})
+    for _ in range(MAX_REDIRECTS + 1):
+      response, body = self._request(url, request_headers, timeout)
+      if response.status in _REDIRECT_STATUSES:
+        location = response.getheader('Location')
+        if location is None:
+          raise HttpError(url, response.status)
+        url = urllib.parse.urljoin(url, location)
+        continue
+      if response.status != 200:
+        raise HttpError(url, response.status)
+      return _decode(body, response.getheader('Content-Encoding'))
+    raise HttpError(url, response.status)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_client():
+  """Returns the HttpClient shared by the process."""
+  global _default_client
+  with _default_client_lock:
+    if _default_client is None:
+      _default_client = HttpClient()
+    return _default_client
+
+
+class ResponseCache:
+  """On-disk cache of response bodies by URL, shared between threads and
+  processes.
+
+  Entries older than the TTL are ignored. When the cache grows beyond its
+  maximum size, the least recently used entries are deleted.
+  """
+
+  def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    os.makedirs(directory, exist_ok=True)
+    self._size = sum(size for _, _, size in self._entries())
+
+  def _path(self, url):
+    digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(self.directory, digest[:2], digest)
+
+  def _entries(self):
+    """Yields (last use, path, size) of all cache files."""
+    for subdir in os.scandir(self.directory):
+      if not subdir.is_dir():
+        continue
+      for entry in os.scandir(subdir.path):
+        if '.tmp' in entry.name:
+          continue
+        try:
+          st = entry.stat()
+        except FileNotFoundError:
+          continue
+        yield st.st_mtime, entry.path, st.st_size
+
+  def get(self, url):
+    """Returns the cached body for `url`, or None."""
+    path = self._path(url)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except FileNotFoundError:
+      return None
+    if len(data) < _CACHE_HEADER.size:
+      return None
+    fetched, = _CACHE_HEADER.unpack_from(data)
+    if time.time() - fetched > self.ttl:
+      return None
+    # The modification time tracks the last use, for eviction.
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      pass
+    return data[_CACHE_HEADER.size:]
+
+  def put(self, url, body):
+    path = self._path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.tmp.{}.{}'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+      f.write(_CACHE_HEADER.pack(time.time()))
+      f.write(body)
+    try:
+      old_size = os.path.getsize(path)
+    except FileNotFoundError:
+      old_size = 0
+    os.replace(tmp_path, path)
+    with self._lock:
+      self._size += _CACHE_HEADER.size + len(body) - old_size
+      if self._size > self.max_bytes:
+        self._evict()
+
+  def _evict(self):
+    """Deletes the least recently used entries, down to 90% of the maximum
+    size. Also picks up the sizes of entries written by other processes."""
+    entries = sorted(self._entries())
+    self._size = sum(size for _, _, size in entries)
+    target = 0.9 * self.max_bytes
+    num_evicted = 0
+    for _, path, size in entries:
+      if self._size <= target:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      self._size -= size
+      num_evicted += 1
+    logging.info('Evicted {} responses from {}'.format(
+      num_evicted, self.directory))
@@ -5,22 +5,25 @@
 import logging
 import urllib.parse
 import json
-from bs4 import BeautifulSoup
 
 from exampledb import scraper
 
 SENTENCE_URL_BASE = 'http://linedict.naver.com/cnen/example/search.dict?page=1&page_size=20&examType=normal&fieldType=&author=&country=&ql=default&format=json&platform=isPC&'
 
+def parse_sentences(data):
+  """Returns the (chinese, english) sentences of a search response."""
+  return [(example['example'], example['translation'])
+          for example in json.loads(data)['exampleList']]
+
+
 class LineDictScraper(scraper.BaseScraper):
-  
-  def get_sentences(self, word):
-    sentences = []
+
+  def url(self, word):
     params = {'query': word.encode('utf-8')}
-    sentence_url = SENTENCE_URL_BASE + urllib.parse.urlencode(params)
-    data = json.loads(self._get(sentence_url))
-    for example in data['exampleList']:
-      sentences.append((example['example'], example['translation']))
-    return sentences
+    return SENTENCE_URL_BASE + urllib.parse.urlencode(params)
+
+  def parse(self, data):
+    return parse_sentences(data)
 
   
 def main():
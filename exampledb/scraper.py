@@ -1,27 +1,73 @@
 """Base class for all scrapers.
 """
 
-import logging
-import urllib.request
+import threading
+import time
+import urllib.parse
+
+from exampledb import fetch
 
 HEADERS = {
   'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36',
   }
 
-# If set to true, then the fetched data will be saved to disk, and loaded
-# from there on the next run. Useful for debugging and fixing scraping code.
-DEBUG=False
+# Default seconds to wait for a site, see BaseScraper.timeout.
+DEFAULT_TIMEOUT = fetch.DEFAULT_TIMEOUT
+
+class RateLimiter:
+  """Spaces out requests to each host, shared between threads."""
+
+  def __init__(self, requests_per_second):
+    self.interval = 1.0 / requests_per_second
+    self._lock = threading.Lock()
+    # Map from host to the earliest time of its next request.
+    self._next_request = {}
+
+  def wait(self, host):
+    """Blocks until a request to `host` may be sent."""
+    with self._lock:
+      now = time.monotonic()
+      request_time = max(self._next_request.get(host, now), now)
+      self._next_request[host] = request_time + self.interval
+    time.sleep(request_time - now)
 
 class BaseScraper:
+  # Seconds to wait for a site to connect or send data, and for
+  # get_sentences() when called through ExampleDb.
+  timeout = DEFAULT_TIMEOUT
+  # If set, a RateLimiter for all requests of the scraper.
+  rate_limiter = None
+  # If set, a fetch.ResponseCache the scraper reads responses from before
+  # fetching them. Handy for debugging and fixing scraping code too.
+  cache = None
+  # The fetch.HttpClient for requests, or None for the shared one.
+  client = None
+
+  def url(self, word):
+    """Returns the URL of the page with example sentences for a word."""
+    raise NotImplementedError
+
+  def parse(self, data):
+    """Returns a list of (chinese, english) sentences from a page.
+
+    Only depends on the page, so saved pages can be parsed again, e.g.
+    after fixing the parser for a new site layout.
+    """
+    raise NotImplementedError
+
+  def get_sentences(self, word):
+    """Returns a list of (chinese, english) example sentences for a word."""
+    return self.parse(self._get(self.url(word)))
+
   def _get(self, url):
-    request = urllib.request.Request(url, headers=HEADERS)
-    if DEBUG:
-      logging.info('Scraper debug mode is enabled')
-      try:
-        return open('/tmp/scraped_data.txt').read()
-      except FileNotFoundError:
-        logging.info('Saved scrape not found, fetching live.')
-    data = urllib.request.urlopen(request).read()
-    if DEBUG:
-      open('/tmp/scraped_data.txt', 'w').write(data.decode('utf-8'))
+    if self.cache is not None:
+      data = self.cache.get(url)
+      if data is not None:
+        return data
+    if self.rate_limiter is not None:
+      self.rate_limiter.wait(urllib.parse.urlsplit(url).netloc)
+    client = self.client or fetch.get_client()
+    data = client.get(url, headers=HEADERS, timeout=self.timeout)
+    if self.cache is not None:
+      self.cache.put(url, data)
     return data
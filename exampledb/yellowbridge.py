@@ -4,38 +4,105 @@
 NOTE: the english translations this scraper provides are a little broken.
 """
 
+import itertools
 import logging
 import unicodedata
 import urllib.parse
-from bs4 import BeautifulSoup
+from lxml import etree
 
 from exampledb import scraper
 
 SENTENCE_URL_BASE = 'http://www.yellowbridge.com/chinese/sentsearch.php?word='
 
+# Special characters that yellowbridge uses for tooltips, for str.translate().
+# The numbers are all in the Enclosed Alphanumerics and Enclosed CJK Letters
+# and Months blocks.
+_TOOLTIP_PREFIXES = ('CIRCLED DIGIT', 'PARENTHESIZED DIGIT', 'CIRCLED NUMBER')
+_TOOLTIP_CHARS = {
+  c: None for c in itertools.chain(range(0x2460, 0x2500), range(0x3200, 0x3300))
+  if unicodedata.name(chr(c), '').startswith(_TOOLTIP_PREFIXES)}
+_TOOLTIP_CHARS[ord(u'{')] = None
+_TOOLTIP_CHARS[ord(u'}')] = None
+
+
+class _SentenceTarget:
+  """lxml parser target collecting the sentences of a page.
+
+  Gets the parser events instead of a tree, so no elements are built. A
+  sentence is the text of a <span class="zh">, including nested elements,
+  and its translation the text following the next <br>.
+  """
+
+  def __init__(self):
+    self.sentences = []
+    # Text of the current sentence or translation, or None.
+    self._chinese = None
+    self._english = None
+    # Depth of the current element below the zh span.
+    self._depth = 0
+    # True between the end of a zh span and the next <br>.
+    self._after_zh = False
+
+  def _finish(self):
+    self.sentences.append((
+      ''.join(self._chinese).translate(_TOOLTIP_CHARS),
+      ''.join(self._english or ())))
+    self._chinese = None
+    self._english = None
+    self._after_zh = False
+
+  def start(self, tag, attrib):
+    if self._chinese is not None and not self._after_zh:
+      self._depth += 1
+      return
+    if self._english is not None:
+      self._finish()
+    elif self._after_zh:
+      if tag == 'br':
+        self._english = []
+        return
+      self._finish()
+    if tag == 'span' and 'zh' in attrib.get('class', '').split():
+      self._chinese = []
+      self._depth = 0
+
+  def end(self, tag):
+    if self._chinese is not None and not self._after_zh:
+      if self._depth:
+        self._depth -= 1
+      else:
+        self._after_zh = True
+    elif tag != 'br' and (self._english is not None or self._after_zh):
+      self._finish()
+
+  def data(self, text):
+    if self._english is not None:
+      self._english.append(text)
+    elif self._chinese is not None and not self._after_zh:
+      self._chinese.append(text)
+
+  def close(self):
+    if self._after_zh:
+      self._finish()
+    return self.sentences
+
+
+def parse_sentences(html):
+  """Returns the (chinese, english) sentences of a search page."""
+  if isinstance(html, bytes):
+    html = html.decode('utf-8', errors='replace')
+  parser = etree.HTMLParser(target=_SentenceTarget())
+  parser.feed(html)
+  return parser.close()
+
+
 class YellowBridgeScraper(scraper.BaseScraper):
-  
-  def get_sentences(self, word):
-    sentences = []
-    sentence_url = SENTENCE_URL_BASE + urllib.parse.quote(word.encode('utf-8'))
-    html = self._get(sentence_url)
-    soup = BeautifulSoup(html, features="lxml")
-        
-    for span in soup.find_all('span', attrs={'class': 'zh'}):
-      chinese_sentence = []
-      for c in span.text:
-        # Remove some special characters that yellowbridge uses for tooltips.
-        if (unicodedata.name(c).startswith('CIRCLED DIGIT') or
-            unicodedata.name(c).startswith('PARENTHESIZED DIGIT') or
-            unicodedata.name(c).startswith('CIRCLED NUMBER')):
-          continue
-        if c == u'{' or c == u'}':
-          continue
-        chinese_sentence.append(c)
-      chinese_sentence = ''.join(chinese_sentence)
-      english_sentence = str(span.next_sibling.next_sibling)
-      sentences.append((chinese_sentence, english_sentence))
-    return sentences
+
+  def url(self, word):
+    return SENTENCE_URL_BASE + urllib.parse.quote(word.encode('utf-8'))
+
+  def parse(self, data):
+    return parse_sentences(data)
 
   
 def main():
@@ -0,0 +1,155 @@
+"""
+measure_anki_lookup times per-word card lookups in AnkiReader, with and
+without the note index, and reading the known characters and words, with and
+without the known items cache, and scoring known items from the review log,
+on a synthetic collection.
+"""
+
+from absl import app
+from absl import flags
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import anki
+
+FLAGS = flags.FLAGS
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+flags.DEFINE_integer('num_notes', 50000, 'Number of notes per deck.')
+flags.DEFINE_integer('num_lookups', 500,
+                     'Number of words looked up in each deck.')
+flags.DEFINE_integer('reviews_per_card', 20,
+                     'Number of review log entries per card.')
+
+def make_collection(path, num_notes, reviews_per_card=0):
+  """Writes a collection with the tables and decks AnkiReader reads."""
+  rng = random.Random(0)
+  conn = sqlite3.connect(path)
+  conn.executescript("""
+    CREATE TABLE col (mod INTEGER, usn INTEGER);
+    CREATE TABLE decks (id INTEGER PRIMARY KEY, name TEXT);
+    CREATE TABLE notes (id INTEGER PRIMARY KEY, mod INTEGER, flds TEXT);
+    CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, did INTEGER,
+                        mod INTEGER);
+    CREATE INDEX ix_cards_nid ON cards (nid);
+    CREATE INDEX ix_cards_sched ON cards (did);
+    CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER, ease INTEGER,
+                         ivl INTEGER, type INTEGER);
+    CREATE INDEX ix_revlog_cid ON revlog (cid);
+    INSERT INTO col VALUES (0, 0);
+  """)
+  decks = [anki.CHARACTERS_DECK, anki.LEGACY_WORDS_DECK, anki.GENERAL_DECK]
+  conn.executemany('INSERT INTO decks VALUES (?, ?)', enumerate(decks))
+  note_id = 0
+  words = {}
+  for deck_id, deck in enumerate(decks):
+    words[deck] = []
+    for _ in range(num_notes):
+      word = ''.join(chr(rng.randrange(0x4e00, 0x9fa5))
+                     for _ in range(rng.randint(1, 3)))
+      words[deck].append(word)
+      if deck == anki.GENERAL_DECK:
+        fields = [u'example with {}'.format(word), '', 'hint', word,
+                  'sentence', 'info', 'y']
+      else:
+        fields = [word, 'pinyin', 'meaning']
+      conn.execute('INSERT INTO notes VALUES (?, ?, ?)',
+                   (note_id, note_id, u'\u001f'.join(fields)))
+      conn.execute('INSERT INTO cards (nid, did, mod) VALUES (?, ?, ?)',
+                   (note_id, deck_id, note_id))
+      note_id += 1
+  if reviews_per_card:
+    conn.executemany('INSERT INTO revlog VALUES (?, ?, ?, ?, ?)',
+                     make_reviews(rng, note_id, reviews_per_card))
+  conn.commit()
+  conn.close()
+  return words
+
+def make_reviews(rng, num_cards, reviews_per_card):
+  """Yields revlog rows of cards reviewed once a day, oldest first."""
+  review_id = 0
+  ivls = [0] * num_cards
+  for day in range(reviews_per_card):
+    for cid in range(num_cards):
+      review_id += 1
+      if ivls[cid] == 0:
+        ease, ivl, type_ = 3, 1, 0
+      elif rng.random() < 0.1:
+        ease, ivl, type_ = 1, -600, 1
+      else:
+        ease, ivl, type_ = 3, 2 * max(ivls[cid], 1), 1
+      ivls[cid] = max(ivl, 0)
+      yield (day * MS_PER_DAY + review_id, cid + 1, ease, ivl, type_)
+
+def time_lookups(reader, words):
+  start = time.time()
+  for word in words[anki.CHARACTERS_DECK]:
+    reader.get_character_cards(word)
+  for word in words[anki.LEGACY_WORDS_DECK]:
+    reader.get_legacy_word_cards(word)
+  for word in words[anki.GENERAL_DECK]:
+    reader.get_word_cards(word)
+  return time.time() - start
+
+def time_known(reader):
+  start = time.time()
+  reader.get_known_characters()
+  reader.get_known_legacy_words()
+  reader.get_known_words()
+  return time.time() - start
+
+def time_scores(reader):
+  start = time.time()
+  reader.get_known_scores()
+  return time.time() - start
+
+def touch_collection(path, num_notes):
+  """Edits a few notes and reviews a few cards, like a day of use."""
+  conn = sqlite3.connect(path)
+  mod = 10 * num_notes
+  conn.execute('UPDATE notes SET mod=? WHERE id % 1000 = 0', (mod,))
+  conn.execute('UPDATE cards SET mod=? WHERE id % 500 = 0', (mod,))
+  conn.execute('UPDATE col SET mod=?', (mod,))
+  conn.commit()
+  conn.close()
+
+def main(argv):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    path = os.path.join(tmp_dir, 'collection.anki2')
+    words = make_collection(path, FLAGS.num_notes, FLAGS.reviews_per_card)
+    lookups = {deck: random.Random(1).sample(deck_words, FLAGS.num_lookups)
+               for deck, deck_words in words.items()}
+    num_lookups = 3 * FLAGS.num_lookups
+
+    elapsed = time_lookups(anki.AnkiReader(path), lookups)
+    print('LIKE scans:  {:.2f}ms per lookup'.format(
+      1000 * elapsed / num_lookups))
+
+    start = time.time()
+    reader = anki.AnkiReader(path, index_notes=True)
+    index_time = time.time() - start
+    elapsed = time_lookups(reader, lookups)
+    print('Note index:  built in {:.2f}s, {:.4f}ms per lookup'.format(
+      index_time, 1000 * elapsed / num_lookups))
+
+    cache_path = os.path.join(tmp_dir, 'known.cache')
+    print('Known items, full read:     {:.3f}s'.format(
+      time_known(anki.AnkiReader(path))))
+    print('Known items, cold cache:    {:.3f}s'.format(
+      time_known(anki.AnkiReader(path, known_cache_path=cache_path))))
+    print('Known items, no changes:    {:.3f}s'.format(
+      time_known(anki.AnkiReader(path, known_cache_path=cache_path))))
+    touch_collection(path, FLAGS.num_notes)
+    print('Known items, after changes: {:.3f}s'.format(
+      time_known(anki.AnkiReader(path, known_cache_path=cache_path))))
+
+    num_reviews = 3 * FLAGS.num_notes * FLAGS.reviews_per_card
+    print('Known scores from {} reviews: {:.3f}s'.format(
+      num_reviews, time_scores(anki.AnkiReader(path))))
+
+if __name__ == "__main__":
+  app.run(main)
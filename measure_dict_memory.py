@@ -0,0 +1,129 @@
+"""
+measure_dict_memory reports how much resident memory loading the dictionary
+takes, to keep an eye on the size of the in-memory representation.
+
+It also compares the entries and meanings of CC-CEDICT in the current layout
+with the layout cdict used before, a dataclass per entry holding its own list
+of dataclass meanings. Each layout is loaded in a child process, so neither
+measurement includes memory left over from the other.
+"""
+
+from absl import app
+from absl import flags
+from dataclasses import dataclass, field
+import gc
+import logging
+import multiprocessing
+import os
+import re
+import time
+from typing import List
+
+from common import cdict
+from common import config
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('data_dir', None,
+                    'Directory with dictionary source files, defaults to the '
+                    'data directory from config.json.')
+flags.DEFINE_bool('snapshot', False,
+                  'Load the dictionary through its binary snapshot.')
+flags.DEFINE_bool('compare', True,
+                  'Also compare the memory of CC-CEDICT entries in the '
+                  'current and the previous layout.')
+
+def get_rss_kb():
+  """Returns the current resident set size of this process, in KB."""
+  with open('/proc/self/status') as f:
+    for line in f:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1])
+  raise RuntimeError('VmRSS not found in /proc/self/status')
+
+@dataclass
+class BaselineMeaningEntry:
+  pinyin: str
+  meaning: str
+
+@dataclass
+class BaselineDictEntry:
+  word: str
+  traditional: str
+  meanings: List[BaselineMeaningEntry] = field(default_factory=list)
+  char_frequency: float = 0.0
+  word_frequency: float = 0.0
+  char_hsk_level: int = 0
+  word_hsk_level: int = 0
+
+def load_baseline_entries(data_dir):
+  """Loads CC-CEDICT the way cdict did before its entries were slotted."""
+  entries = {}
+  traditional_to_entry = {}
+  with open(os.path.join(data_dir, cdict.CEDICT_FILE)) as f:
+    for line in f:
+      if line[0] == '#':
+        continue
+      m = re.match(r"(\S*)\s(\S*)\s\[(.*)\] /(.*)/", line)
+      assert m
+      trad, word, pinyin, meaning = m.groups()
+      if not word in entries:
+        entries[word] = BaselineDictEntry(word, trad)
+        traditional_to_entry[trad] = entries[word]
+      entries[word].meanings.append(BaselineMeaningEntry(pinyin, meaning))
+  return entries, traditional_to_entry
+
+def load_entries(data_dir):
+  """Loads CC-CEDICT in the current layout, without the other layers."""
+  return cdict.Dict(data_dir, defer=cdict.LAYERS)
+
+def measure_rss_kb(load, data_dir):
+  """Returns the RSS growth of load(data_dir), run in a child process."""
+  with multiprocessing.get_context('fork').Pool(1) as pool:
+    return pool.apply(_measure_rss_kb, (load, data_dir))
+
+def _measure_rss_kb(load, data_dir):
+  gc.collect()
+  before = get_rss_kb()
+  # Keep the result referenced until the RSS is read.
+  loaded = load(data_dir)
+  gc.collect()
+  return get_rss_kb() - before
+
+def main(argv):
+  data_dir = FLAGS.data_dir or config.get_data_dir()
+
+  if FLAGS.compare:
+    # Measured first, while this process is still small.
+    baseline_kb = measure_rss_kb(load_baseline_entries, data_dir)
+    current_kb = measure_rss_kb(load_entries, data_dir)
+
+  gc.collect()
+  before = get_rss_kb()
+  start = time.time()
+  if FLAGS.snapshot:
+    d = cdict.Dict.from_snapshot(data_dir)
+  else:
+    d = cdict.Dict(data_dir)
+  elapsed = time.time() - start
+  gc.collect()
+  after = get_rss_kb()
+
+  print('Loaded {} entries with {} meanings in {:.2f}s'.format(
+    len(d.entries), len(d.meaning_table), elapsed))
+  print('RSS before load: {:.1f} MB'.format(before / 1024))
+  print('RSS after load:  {:.1f} MB'.format(after / 1024))
+  print('Dictionary:      {:.1f} MB ({:.0f} bytes per entry)'.format(
+    (after - before) / 1024, (after - before) * 1024 / len(d.entries)))
+
+  if FLAGS.compare:
+    print('CC-CEDICT entries and meanings:')
+    print('  previous layout: {:.1f} MB'.format(baseline_kb / 1024))
+    print('  current layout:  {:.1f} MB'.format(current_kb / 1024))
+    print('  saved:           {:.1f} MB ({:.0%})'.format(
+      (baseline_kb - current_kb) / 1024,
+      (baseline_kb - current_kb) / baseline_kb))
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  app.run(main)
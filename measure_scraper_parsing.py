@@ -0,0 +1,153 @@
+"""
+measure_scraper_parsing replays saved scraper responses through the parsers
+of the scrapers, and reports parse throughput per source. Yellowbridge pages
+are also parsed with the BeautifulSoup parser used before, reporting pages
+where the results differ, which helps when changing the parser after a site
+layout change.
+
+Saved responses are read from --fixture_dir, with one subdirectory per
+source, e.g. yellowbridge/加剧.html. Without it, synthetic pages made by
+exampledb.fake_sites are used. --save_words fetches the pages of some words
+into --fixture_dir first.
+"""
+
+from absl import app
+from absl import flags
+from bs4 import BeautifulSoup
+import os
+import time
+import unicodedata
+
+from exampledb import fake_sites
+from exampledb import linedict
+from exampledb import yellowbridge
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('fixture_dir', None,
+                    'Directory with saved responses, in a subdirectory per '
+                    'source.')
+flags.DEFINE_list('save_words', [],
+                  'Words whose pages to fetch into --fixture_dir first.')
+flags.DEFINE_integer('num_pages', 200, 'Number of synthetic pages per source.')
+flags.DEFINE_integer('sentences_per_page', 20,
+                     'Number of sentences per synthetic page.')
+flags.DEFINE_integer('repeat', 3, 'Number of times to parse all pages.')
+flags.DEFINE_boolean('compare', True,
+                     'Also run the previous parsers, and compare results.')
+
+
+def reference_yellowbridge(html):
+  """The BeautifulSoup parser yellowbridge.parse_sentences() replaced."""
+  sentences = []
+  soup = BeautifulSoup(html, features="lxml")
+  for span in soup.find_all('span', attrs={'class': 'zh'}):
+    chinese_sentence = []
+    for c in span.text:
+      if (unicodedata.name(c).startswith('CIRCLED DIGIT') or
+          unicodedata.name(c).startswith('PARENTHESIZED DIGIT') or
+          unicodedata.name(c).startswith('CIRCLED NUMBER')):
+        continue
+      if c == u'{' or c == u'}':
+        continue
+      chinese_sentence.append(c)
+    chinese_sentence = ''.join(chinese_sentence)
+    english_sentence = str(span.next_sibling.next_sibling)
+    sentences.append((chinese_sentence, english_sentence))
+  return sentences
+
+
+# Map from source name to (scraper, parser, previous parser or None, file
+# suffix).
+SOURCES = {
+  'linedict': (linedict.LineDictScraper(), linedict.parse_sentences, None,
+               '.json'),
+  'yellowbridge': (yellowbridge.YellowBridgeScraper(),
+                   yellowbridge.parse_sentences, reference_yellowbridge,
+                   '.html'),
+}
+
+
+def save_pages(fixture_dir, words):
+  for name, (scraper, _, _, suffix) in SOURCES.items():
+    os.makedirs(os.path.join(fixture_dir, name), exist_ok=True)
+    for word in words:
+      data = scraper._get(scraper.url(word))
+      with open(os.path.join(fixture_dir, name, word + suffix), 'wb') as f:
+        f.write(data)
+
+
+def load_pages(fixture_dir):
+  """Returns a map from source name to a list of saved responses."""
+  pages = {}
+  for name in SOURCES:
+    source_dir = os.path.join(fixture_dir, name)
+    if not os.path.isdir(source_dir):
+      continue
+    pages[name] = []
+    for filename in sorted(os.listdir(source_dir)):
+      with open(os.path.join(source_dir, filename), 'rb') as f:
+        pages[name].append(f.read())
+  return pages
+
+
+def make_pages(num_pages, sentences_per_page):
+  """Returns synthetic pages, like load_pages()."""
+  words = ['词{}'.format(i) for i in range(num_pages)]
+  return {
+    'linedict': [
+      fake_sites.linedict_page(
+        fake_sites.make_sentences(word, sentences_per_page)).encode('utf-8')
+      for word in words],
+    'yellowbridge': [
+      fake_sites.yellowbridge_page(
+        word, fake_sites.make_sentences(word, sentences_per_page)
+      ).encode('utf-8')
+      for word in words],
+  }
+
+
+def time_parser(parse, pages):
+  """Returns the seconds per parse of all pages, best of --repeat, and the
+  results."""
+  best = None
+  for _ in range(FLAGS.repeat):
+    start = time.time()
+    results = [parse(page) for page in pages]
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, results
+
+
+def main(argv):
+  if FLAGS.save_words:
+    save_pages(FLAGS.fixture_dir, FLAGS.save_words)
+  if FLAGS.fixture_dir:
+    pages = load_pages(FLAGS.fixture_dir)
+  else:
+    pages = make_pages(FLAGS.num_pages, FLAGS.sentences_per_page)
+
+  for name, source_pages in pages.items():
+    _, parse, reference_parse, _ = SOURCES[name]
+    num_bytes = sum(len(page) for page in source_pages)
+    elapsed, results = time_parser(parse, source_pages)
+    num_sentences = sum(len(sentences) for sentences in results)
+    print('{}: {} pages, {:.1f}MB, {} sentences'.format(
+      name, len(source_pages), num_bytes / 1e6, num_sentences))
+    print('  parser: {:.0f} pages/s, {:.1f}MB/s, {:.0f} sentences/s'.format(
+      len(source_pages) / elapsed, num_bytes / 1e6 / elapsed,
+      num_sentences / elapsed))
+    if not FLAGS.compare or reference_parse is None:
+      continue
+    reference_elapsed, reference_results = time_parser(
+      reference_parse, source_pages)
+    print('  previous parser: {:.0f} pages/s, {:.1f}x the time'.format(
+      len(source_pages) / reference_elapsed, reference_elapsed / elapsed))
+    num_different = sum(1 for a, b in zip(results, reference_results)
+                        if a != b)
+    if num_different:
+      print('  {} pages parsed differently'.format(num_different))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,218 @@
+"""
+prefetch_examples scrapes example sentences for a list of words into the
+example database, so card_creator finds them there on first view.
+
+Words are HSK words, the most frequent words, or the known anki words. Runs
+can be interrupted, the next run resumes with the words not done yet.
+
+To try it out against a local stand-in for the sites, run
+python3 -m exampledb.fake_sites and pass --local_server=http://localhost:8000.
+"""
+
+from absl import app
+from absl import flags
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+from common import anki
+from common import cdict
+from common import config
+from exampledb import difficulty
+from exampledb import exampledb
+from exampledb import fetch
+from exampledb import linedict
+from exampledb import scraper
+from exampledb import yellowbridge
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_enum('words', 'hsk', ['hsk', 'frequency', 'anki'],
+                  'Words to prefetch: all HSK words, the --top_n most '
+                  'frequent words, or the known anki words.')
+flags.DEFINE_integer('top_n', 5000,
+                     'Number of words to prefetch with --words=frequency.')
+flags.DEFINE_integer('workers', 4, 'Number of words scraped at once.')
+flags.DEFINE_float('requests_per_second', 1.0,
+                   'Maximum requests per second to each site.')
+flags.DEFINE_integer('retries', 3, 'Retries of a failed request.')
+flags.DEFINE_float('backoff', 2.0,
+                   'Seconds to wait before the first retry, doubled for '
+                   'each further retry.')
+flags.DEFINE_string('db_path', None,
+                    'Path to the example database, defaults to the one from '
+                    'config.json.')
+flags.DEFINE_string('checkpoint_file', None,
+                    'File listing the words done so far, defaults to '
+                    'examples_prefetch.txt next to the example database.')
+flags.DEFINE_string('cache_dir', None,
+                    'Directory of the scraper response cache, defaults to the '
+                    'one from config.json.')
+flags.DEFINE_string('local_server', None,
+                    'If set, e.g. http://localhost:8000, fetch from there '
+                    'instead of the real sites.')
+flags.DEFINE_float('stats_interval', 10.0,
+                   'Seconds between throughput reports.')
+
+# Modules of the scrapers used by ExampleDb, for --local_server.
+SCRAPER_MODULES = [linedict, yellowbridge]
+
+
+class Stats:
+  """Thread-safe counters, with throughput reporting."""
+
+  def __init__(self):
+    self.start = time.time()
+    self._lock = threading.Lock()
+    self.counts = {
+      'words': 0,
+      'stored': 0,
+      'empty': 0,
+      'failed': 0,
+      'requests': 0,
+      'retries': 0,
+      'examples': 0,
+    }
+
+  def add(self, name, n=1):
+    with self._lock:
+      self.counts[name] += n
+
+  def report(self, num_words):
+    elapsed = time.time() - self.start
+    c = self.counts
+    print('{}/{} words in {:.0f}s, {:.2f} words/s, {:.2f} requests/s, '
+          '{:.1f} examples/s. {} stored, {} without examples, {} failed, '
+          '{} retries.'.format(
+            c['words'], num_words, elapsed, c['words'] / elapsed,
+            c['requests'] / elapsed, c['examples'] / elapsed, c['stored'],
+            c['empty'], c['failed'], c['retries']))
+
+
+def get_words(d):
+  if FLAGS.words == 'anki':
+    reader = anki.AnkiReader(
+      config.get_anki_collection(),
+      known_cache_path=config.get_anki_known_cache_path())
+    return sorted(set(reader.get_known_words() +
+                      reader.get_known_legacy_words()))
+  if FLAGS.words == 'hsk':
+    return [w for level in d.hsk_words for w in level]
+  index = d.word_index
+  return [w for w, rank in zip(index.words, index.ranks) if rank][:FLAGS.top_n]
+
+
+def use_local_server(local_server):
+  for module in SCRAPER_MODULES:
+    url = urllib.parse.urlsplit(module.SENTENCE_URL_BASE)
+    module.SENTENCE_URL_BASE = local_server + urllib.parse.urlunsplit(
+      ('', '', url.path, url.query, url.fragment))
+
+
+def scrape_word(scrapers, word, stats):
+  """Returns a list of (source, sentences) for the word from all scrapers,
+  or None if any of them still fails after all retries."""
+  scraped = []
+  for source, s in scrapers.items():
+    for attempt in range(FLAGS.retries + 1):
+      stats.add('requests')
+      try:
+        scraped.append((source, s.get_sentences(word)))
+        break
+      except Exception as e:
+        if attempt == FLAGS.retries:
+          logging.warning('Giving up on {} for {}: {}'.format(
+            s.__class__.__name__, word, e))
+          return None
+        stats.add('retries')
+        delay = FLAGS.backoff * 2 ** attempt
+        time.sleep(random.uniform(0.5, 1.5) * delay)
+  return scraped
+
+
+def main(argv):
+  if FLAGS.local_server:
+    use_local_server(FLAGS.local_server)
+  db_path = FLAGS.db_path or config.get_example_db_path()
+  checkpoint_file = FLAGS.checkpoint_file or os.path.join(
+    os.path.dirname(db_path), 'examples_prefetch.txt')
+
+  response_cache = fetch.ResponseCache(
+    FLAGS.cache_dir or config.get_scrape_cache_dir())
+  # The dictionary also gives the features stored with new sentences.
+  d = cdict.Dict.from_snapshot(config.get_data_dir())
+  db = exampledb.ExampleDb(db_path, response_cache=response_cache,
+                           vocabulary=difficulty.Vocabulary(d))
+  rate_limiter = scraper.RateLimiter(FLAGS.requests_per_second)
+  for s in db.scrapers.values():
+    s.rate_limiter = rate_limiter
+
+  # Words with no examples are only in the checkpoint.
+  done = db.get_words()
+  try:
+    with open(checkpoint_file) as f:
+      done.update(line.rstrip('\n') for line in f)
+  except FileNotFoundError:
+    pass
+  all_words = get_words(d)
+  words = [w for w in dict.fromkeys(all_words) if w not in done]
+  print('{} of {} words left to prefetch.'.format(len(words), len(all_words)))
+
+  stats = Stats()
+  last_report = time.time()
+  with open(checkpoint_file, 'a') as checkpoint, \
+       concurrent.futures.ThreadPoolExecutor(FLAGS.workers) as executor:
+    pending = {}
+    next_word = 0
+    try:
+      while next_word < len(words) or pending:
+        # Keep a bounded number of words in flight.
+        while next_word < len(words) and len(pending) < 2 * FLAGS.workers:
+          word = words[next_word]
+          future = executor.submit(scrape_word, db.scrapers, word, stats)
+          pending[future] = word
+          next_word += 1
+        finished, _ = concurrent.futures.wait(
+          pending, timeout=FLAGS.stats_interval,
+          return_when=concurrent.futures.FIRST_COMPLETED)
+        # Only this thread writes to the database and the checkpoint. The
+        # words finished together are stored in one transaction.
+        entries = []
+        done_words = []
+        for future in finished:
+          word = pending.pop(future)
+          stats.add('words')
+          scraped = future.result()
+          if scraped is None:
+            stats.add('failed')
+            continue
+          entry = exampledb.make_entry(word, scraped)
+          if entry.examples:
+            entries.append(entry)
+            stats.add('stored')
+            stats.add('examples', len(entry.examples))
+          else:
+            stats.add('empty')
+          done_words.append(word)
+        if entries:
+          db.insert_entries(entries)
+        checkpoint.writelines(word + '\n' for word in done_words)
+        checkpoint.flush()
+        if time.time() - last_report >= FLAGS.stats_interval:
+          stats.report(len(words))
+          last_report = time.time()
+    except KeyboardInterrupt:
+      print('Interrupted, words in progress are scraped again next run.')
+      for future in pending:
+        future.cancel()
+  stats.report(len(words))
+  db.close()
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  app.run(main)